@@ -4,7 +4,9 @@
     device inventory into NetBox using PyPi package pynetbox
 
     Args:
-    usage: cc2netbox.py [-h] [-d] [--stage2]
+    usage: cc2netbox.py [-h] [-d] [--stage2] [--merge] [--family FAMILY]
+                        [--site-id SITE_ID] [--workers N] [--reconcile]
+                        [--prune] [--incremental]
 
     TO-DO Description
 
@@ -13,6 +15,23 @@
     -d, --debug        Enables debug with copious console output
     --stage2           Run second stage discovery process; done on second
                        iteration
+    --merge            Without --stage2, append only new devices and
+                       device models to the existing mapping files,
+                       keeping entries already edited
+    --family FAMILY    Catalyst Center device family to collect; repeat
+                       for several families, collected concurrently
+                       (default: 'Switches and Hubs')
+    --site-id SITE_ID  Catalyst Center site id to collect from; repeat
+                       for several sites, collected concurrently
+    --workers N        With --stage2, import each device's create,
+                       interface, IP and primary-IP chain on a pool of
+                       N concurrent workers instead of bulk stages
+    --reconcile        With --stage2, compare Catalyst Center inventory
+                       with NetBox and only write the differences
+    --prune            With --reconcile, delete NetBox devices in the
+                       mapped locations that Catalyst Center no longer has
+    --incremental      With --stage2, reconcile only devices changed since
+                       the last successful sync (cc2netbox_checkpoint.json)
     
     Inputs/Reference files:
         cc2netbox.yaml - contains Catalyst Center service specs -
@@ -34,10 +53,20 @@
     1   2024-0522   Initial development
     2   2024-0617   Remove hard-coded device-model types (gh issue 1)
                     Update Usage/args docs
+    3   2026-1017   Paged, concurrent Catalyst Center inventory fetch
+                    Staged bulk device/interface/IP import
+                    In-memory NetBox reference-data index
+                    Concurrent per-device worker mode (--workers)
+                    Diff-based reconcile mode (--reconcile, --prune)
+                    Batch n-gram device-type matching
+                    Cached device-type catalog
+                    Concurrent multi-family/multi-site collection
+                    Incremental sync with checkpoint (--incremental)
+                    Merge new entries into mapping files (--merge)
 """
 
 # Credits:
-__version__ = '2'
+__version__ = '3'
 __author__ = 'Jason Davis - jadavis@cisco.com'
 __license__ = "'Apache License, Version 2.0 - ' \
     'http://www.apache.org/licenses/LICENSE-2.0'"
@@ -47,8 +76,17 @@ __license__ = "'Apache License, Version 2.0 - ' \
 import argparse
 import sys
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import heapq
+from itertools import islice
+import json
+import threading
+import time
 
 from common.getEnv import getparam
+from common.ngramMatch import NgramMatcher
+from common.dtCatalog import get_devicetypes
 from dnacentersdk import api
 import requests
 import pynetbox
@@ -58,29 +96,91 @@ from slugify import slugify
 
 
 
+# Incremental sync checkpoint (see --incremental)
+CHECKPOINTFILE = 'cc2netbox_checkpoint.json'
+
+
 ########################################################################
 #### Class definitions
 
+class RefIndex:
+    """In-memory index of NetBox reference data, loaded once per run
+
+    Holds device roles, locations (with their site id) and manufacturers
+    keyed by name, slug and id, so per-device lookups are dictionary hits
+    instead of API calls.  Objects created during the run are added with
+    add() to keep the index current.  Hold 'lock' around any
+    lookup-then-create so concurrent workers create an object only once.
+    """
+    KEYS = ('name', 'slug', 'id')
+
+    def __init__(self, nb):
+        self.nb = nb
+        self.lock = threading.RLock()
+        self.roles = self._build(nb.dcim.device_roles.all())
+        self.locations = self._build(nb.dcim.locations.all())
+        self.manufacturers = self._build(nb.dcim.manufacturers.all())
+
+    def _build(self, records):
+        index = {key: {} for key in self.KEYS}
+        for record in records:
+            self._add(index, record)
+        return index
+
+    def _add(self, index, record):
+        # pynetbox Records serialise to plain dicts with nested objects
+        record = dict(record)
+        entry = {'id': record['id'],
+                 'name': record['name'],
+                 'slug': record['slug']}
+        if record.get('site') is not None:
+            # Locations carry their parent site id
+            entry['site_id'] = record['site']['id']
+        for key in self.KEYS:
+            index[key][entry[key]] = entry
+
+    def add(self, kind, record):
+        # Add a newly created NetBox object to the 'roles', 'locations'
+        # or 'manufacturers' index
+        self._add(getattr(self, kind), record)
+
+    def get(self, kind, name=None, slug=None, id=None):
+        # Look up an indexed object by name, slug or id; None if unknown
+        index = getattr(self, kind)
+        for key, value in (('name', name), ('slug', slug), ('id', id)):
+            if value is not None:
+                return index[key].get(value)
+        return None
+
+
 
 ########################################################################
 #### Function definitions
 
-def get_role(cc_role, nb, nb_roles):
+def chunked(iterable, size):
+    # Yield lists of up to 'size' items from any iterable or generator
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def get_role(cc_role, nb, index):
     # Match Catalyst Center role to existing NetBox roles, or create
-    nb_role = nb.dcim.device_roles.get(name=cc_role)
-    if nb_role is None:
-        # Create missing Catalyst Center role in NetBox
-        role = nb.dcim.device_roles.create(name=cc_role,
-                                           slug=slugify(cc_role)
-                                           )
-        #print(role)
-        return role['id']
-    else:
-        # Pass roleId back
-        return nb_role['id']
+    with index.lock:
+        nb_role = index.get('roles', name=cc_role)
+        if nb_role is None:
+            # Create missing Catalyst Center role in NetBox
+            role = nb.dcim.device_roles.create(name=cc_role,
+                                               slug=slugify(cc_role)
+                                               )
+            index.add('roles', role)
+            return role['id']
+        else:
+            # Pass roleId back
+            return nb_role['id']
 
 
-def create_nb_devicetype(nb, device):
+def create_nb_devicetype(nb, device, index):
     # Create missing NetBox device-type
     # NetBox device-type create requires:
     #   manufacturer(id as int) - assuming Cisco since from CC,
@@ -89,106 +189,499 @@ def create_nb_devicetype(nb, device):
     # We'll also supplement with:
     #   part_number(string) mapped from CC 'platformId'
     #
-    devicetype = nb.dcim.device_types.create(manufacturer=nb.dcim.manufacturers.get(name='Cisco').id,
+    manufacturer = index.get('manufacturers', name='Cisco')
+    devicetype = nb.dcim.device_types.create(manufacturer=manufacturer['id'],
                                              model=device['type'],
                                              slug=slugify(device['type']),
                                              part_number=device['platformId'])
-    print(devicetype)
-    print(devicetype['id'])
+    print(f"Device-Type '{devicetype}' created with id {devicetype['id']}")
+    return devicetype['id']
 
 
-def import_devices(devices, nb, imp_locations, imp_devicetypes):
-    # Import devices into NetBox
+def get_devicetype_id(nb, device, imp_devicetypes, index):
+    # Map Catalyst Center platformId to NetBox device-type id; '99999'
+    # in the mapping file asks for a new type, created once per run
+    with index.lock:
+        nb_devicetypeid = imp_devicetypes[f"{device['platformId']}"]
+        if nb_devicetypeid == 99999:
+            nb_devicetypeid = create_nb_devicetype(nb, device, index)
+            imp_devicetypes[f"{device['platformId']}"] = nb_devicetypeid
+    return nb_devicetypeid
+
+
+def build_device_payload(nb, device, imp_locations, imp_devicetypes,
+                         index):
+    # Build the NetBox device create payload for a Catalyst Center device
     # NetBox requires:
     #   name(str), device_type(int), role(int), site(int),
     # We will add:
-    #   location(int), primary_ip4(int)[assigned in next step]
-    nb_roles = list(nb.dcim.device_roles.all())
+    #   serial(str), location(int),
+    #   primary_ip4(int)[assigned in a later stage]
+    nb_locationid = imp_locations[f"{device['hostname']}/{device['managementIpAddress']}"]
 
-    for device in devices:
-        nb_name = device['hostname']
-        nb_devicetypeid = imp_devicetypes[f"{device['platformId']}"]
-        if nb_devicetypeid == 99999:
-            nb_devicetypeid = create_nb_devicetype(nb, device)
-        nb_roleid = get_role(device['role'], nb, nb_roles)
-        nb_locationid = imp_locations[f"{device['hostname']}/{device['managementIpAddress']}"]
-        nb_siteid = nb.dcim.locations.get(id=nb_locationid)['site']['id']
-        
-        # Create new device entry
-        newdevice = nb.dcim.devices.create(name=nb_name,
-                                           device_type=nb_devicetypeid,
-                                           role=nb_roleid,
-                                           site=nb_siteid,
-                                           location=nb_locationid)
-        print(newdevice)
-        print(newdevice['id'])
-        
-        # Add management interface; int, then IP
-        # NetBox requires:
-        #   name(str), device(id), vdcs(empty list), type(str),
-        #   enabled(bool)
+    return {'name': device['hostname'],
+            'serial': device.get('serialNumber') or '',
+            'device_type': get_devicetype_id(nb, device, imp_devicetypes,
+                                             index),
+            'role': get_role(device['role'], nb, index),
+            'site': index.get('locations', id=nb_locationid)['site_id'],
+            'location': nb_locationid}
+
+
+def import_devices(devices, nb, index, imp_locations, imp_devicetypes,
+                   chunk_size=500):
+    # Import devices into NetBox in stages, one chunk at a time
+    # Each chunk costs four requests, regardless of its size:
+    #   1. bulk create devices; a rejected batch is split in halves and
+    #      retried (see create_device_batch), so only the offending
+    #      devices fail
+    #   2. bulk create 'Management' interfaces on the new devices
+    #   3. bulk create management IPs assigned to those interfaces
+    #   4. bulk update devices with primary_ip4
+    # Each bulk request is atomic, but the four stages are not: when a
+    # later stage fails, the objects of the earlier stages are deleted
+    # again (rollback), so a rerun can import the chunk from scratch
+    # A device whose payload cannot be built (eg. platformId without a
+    # device-type mapping) fails alone and is left out of its chunk
+    # Returns a list of (hostname, error) for devices that failed; if a
+    # rollback fails too, the error says which devices were left
+    # partially imported
+    total = 0
+    failures = []
+
+    for chunk in chunked(devices, chunk_size):
+        batch = []
+        for device in chunk:
+            try:
+                batch.append((device, build_device_payload(
+                    nb, device, imp_locations, imp_devicetypes, index)))
+            except pynetbox.core.query.RequestError as e:
+                error = f"payload failed: {e.error}"
+            except Exception as e:
+                error = f"payload failed: {e!r}"
+            else:
+                continue
+            print(f"Device '{device['hostname']}' {error}")
+            failures.append((device['hostname'], error))
+        # Stage 1 - devices
+        created = create_device_batch(nb, batch, failures)
+        if not created:
+            continue
+        chunk = [device for device, newdevice in created]
+        newdevices = [newdevice for device, newdevice in created]
+        newips = []
+        try:
+            # Stage 2 - management interfaces
+            # NetBox requires:
+            #   name(str), device(id), vdcs(empty list), type(str),
+            #   enabled(bool)
+            newints = nb.dcim.interfaces.create(
+                [{'name': 'Management',
+                  'device': newdevice['id'],
+                  'vdcs': [],
+                  'type': 'virtual',
+                  'enabled': True} for newdevice in newdevices])
+
+            # Stage 3 - management IPs
+            # NetBox requires:
+            #   address(str with /mask),
+            # Also adding:
+            #   "assigned_object_type": "dcim.interface",
+            #   "assigned_object_id": newint.id,
+            #   status('reserved')
+            #   role('vip')
+            newips = nb.ipam.ip_addresses.create(
+                [{'address': f"{device['managementIpAddress']}/32",
+                  'assigned_object_type': 'dcim.interface',
+                  'assigned_object_id': newint['id'],
+                  'status': 'reserved',
+                  'role': 'vip'} for device, newint in zip(chunk, newints)])
+
+            # Stage 4 - primary IP assignment
+            nb.dcim.devices.update(
+                [{'id': newdevice['id'], 'primary_ip4': newip['id']}
+                 for newdevice, newip in zip(newdevices, newips)])
+        except pynetbox.core.query.RequestError as e:
+            print(f"Chunk of {len(chunk)} devices starting with "
+                  f"'{chunk[0]['hostname']}' failed: {e.error}")
+            error = str(e.error)
+            if newdevices and not rollback_chunk(nb, newdevices, newips):
+                error += (' (partially imported: device exists without'
+                          ' complete management interface/IP)')
+            failures.extend((device['hostname'], error) for device in chunk)
+            continue
+
+        total += len(newdevices)
+        print(f"Imported {len(newdevices)} devices ({total} so far)")
+    return failures
+
+
+def create_device_batch(nb, batch, failures):
+    # Bulk create the devices of 'batch', a list of (device, payload)
+    # NetBox rejects a whole request if any device in it is bad, so a
+    # rejected batch is split in halves until the offending device(s)
+    # are isolated; they are added to 'failures', all others created
+    # Returns a list of (device, created NetBox device)
+    if not batch:
+        return []
+    try:
+        newdevices = nb.dcim.devices.create([payload for device, payload
+                                             in batch])
+    except pynetbox.core.query.RequestError as e:
+        if len(batch) == 1:
+            hostname = batch[0][0]['hostname']
+            print(f"Device '{hostname}' failed: {e.error}")
+            failures.append((hostname, f"device failed: {e.error}"))
+            return []
+        middle = len(batch) // 2
+        return (create_device_batch(nb, batch[:middle], failures)
+                + create_device_batch(nb, batch[middle:], failures))
+    return [(device, newdevice) for (device, payload), newdevice
+            in zip(batch, newdevices)]
+
+
+def rollback_chunk(nb, newdevices, newips):
+    # Delete the IPs and devices created for a chunk whose import failed
+    # at a later stage (deleting a device also deletes its interfaces)
+    # Returns True if the rollback succeeded
+    try:
+        if newips:
+            nb.ipam.ip_addresses.delete([newip['id'] for newip in newips])
+        nb.dcim.devices.delete([newdevice['id'] for newdevice in newdevices])
+    except pynetbox.core.query.RequestError as e:
+        print(f"Rollback of {len(newdevices)} devices failed: {e.error}")
+        return False
+    print(f"Rolled back {len(newdevices)} devices")
+    return True
+
+
+def import_device_chain(nb, index, device, imp_locations, imp_devicetypes):
+    # Import a single device: create -> Management interface -> IP ->
+    # primary_ip4.  Each step depends on the id returned by the previous
+    # one.  On failure the exception is re-raised with the failed step.
+    step = 'device'
+    try:
+        payload = build_device_payload(nb, device, imp_locations,
+                                       imp_devicetypes, index)
+        newdevice = nb.dcim.devices.create(payload)
+
+        step = 'interface'
         newint = nb.dcim.interfaces.create(name='Management',
                                            device=newdevice['id'],
                                            vdcs=[],
                                            type='virtual',
                                            enabled=True)
-        print(newint)
-        print(newint['id'])
-        
-        # Create IP
-        # NetBox requires:
-        #   address(str with /mask), 
-        # Also adding:
-        #   "assigned_object_type": "dcim.interface",
-        #   "assigned_object_id": newint.id,
-        #   status('reserved')
-        #   role('vip')
+
+        step = 'ip address'
         newip = nb.ipam.ip_addresses.create(address=f"{device['managementIpAddress']}/32",
-                                             assigned_object_type="dcim.interface",
-                                             assigned_object_id=newint['id'],
-                                             status='reserved',
-                                             role='vip')
-        print(newip)
-        print(newip['id'])
+                                            assigned_object_type="dcim.interface",
+                                            assigned_object_id=newint['id'],
+                                            status='reserved',
+                                            role='vip')
 
-        # Update device with management interface assignment
-        updateddevice = nb.dcim.devices.update([{"id": newdevice['id'],
-                                                 "primary_ip4": newip['id']}])
+        step = 'primary ip'
+        nb.dcim.devices.update([{"id": newdevice['id'],
+                                 "primary_ip4": newip['id']}])
+    except pynetbox.core.query.RequestError as e:
+        raise RuntimeError(f"{step} failed: {e.error}") from e
+    except Exception as e:
+        raise RuntimeError(f"{step} failed: {e!r}") from e
+    return newdevice['id']
 
 
-def get_fuzzy_matches(device, nb_devicetypes):
-    # Get list of known device types from NetBox [imported in bulk earlier]
-    #nb_dt_names = [devicetype["model"] for devicetype in nb_devicetypes]
-    #print(nb_device_types)
+def import_devices_concurrent(devices, nb, index, imp_locations,
+                              imp_devicetypes, workers=8):
+    # Import devices into NetBox with a pool of workers, each running one
+    # device's full create chain (see import_device_chain)
+    # At most 2 x workers devices are queued at a time, so the device
+    # stream is consumed as workers free up.  Failures are collected and
+    # summarised at the end instead of aborting the run.
+    failures = []
+    imported = 0
+    pending = {}
 
-    # Do fuzzy compares
-    #print(f"Inside get_fuzzy_matches:\n{device}")
-    """
-    tuples_list = [[(i, j, fuzz.ratio(i,j), fuzz.partial_ratio(i,j),
-                     fuzz.token_sort_ratio(i,j), fuzz.token_set_ratio(i,j))
-                    for j in nb_device_types] for i in imported_models]
-    """
-    """tuples_list = [(device, j, fuzz.partial_ratio(device,j))
-                    for j in nb_dt_names]"""
-    tuples_list = [(device, 
-                    j['model'], 
-                    j['part_number'], 
-                    j['id'], 
-                    fuzz.partial_ratio(device,j['part_number']))
-                   for j in nb_devicetypes]
-
-    #print(tuples_list)
-    #print("-" * 40)
-    #for impmodel in tuples_list:
-    tuples_list.sort(reverse=True, key = lambda x: x[4])
-    #print(tuples_list)
+    def collect(done):
+        nonlocal imported
+        for future in done:
+            hostname = pending.pop(future)
+            try:
+                future.result()
+            except RuntimeError as e:
+                failures.append((hostname, str(e)))
+            else:
+                imported += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for device in devices:
+            future = pool.submit(import_device_chain, nb, index, device,
+                                 imp_locations, imp_devicetypes)
+            pending[future] = device['hostname']
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(pending)[0])
+
+    print(f"Imported {imported} devices with {len(failures)} failures")
+    for hostname, error in failures:
+        print(f"  {hostname}: {error}")
+    return failures
+
+
+def get_nb_snapshot(nb, location_ids, devices, full=True):
+    # Take one bulk snapshot of the NetBox devices Catalyst Center
+    # devices may match, keyed by id, name and serial number
+    # The NetBox devices with the hostnames or serials of 'devices' are
+    # looked up wherever they are, so a device that lives in another
+    # location is matched (and moved) rather than created again.
+    # With 'full' (not incremental) every device of the mapped locations
+    # is fetched as well, as candidates for stale devices.
+    # NetBox names are only unique per site, so 'name' maps to a list
+    # Nested objects are reduced to their ids (primary_ip4 to its
+    # address) so they compare directly with build_device_payload()
+    records = []
+    if full:
+        records.extend(nb.dcim.devices.filter(location_id=sorted(location_ids)))
+    names = [device['hostname'] for device in devices]
+    serials = [device['serialNumber'] for device in devices
+               if device.get('serialNumber')]
+    for chunk in chunked(names, 100):
+        records.extend(nb.dcim.devices.filter(name=chunk))
+    for chunk in chunked(serials, 100):
+        records.extend(nb.dcim.devices.filter(serial=chunk))
+
+    snapshot = {'id': {}, 'name': {}, 'serial': {}}
+    for record in records:
+        record = dict(record)
+        if record['id'] in snapshot['id']:
+            continue
+        primary_ip4 = record.get('primary_ip4')
+        entry = {'id': record['id'],
+                 'name': record['name'],
+                 'serial': record.get('serial') or '',
+                 'device_type': record['device_type']['id'],
+                 'role': record['role']['id'],
+                 'site': record['site']['id'],
+                 'location': (record['location'] or {}).get('id'),
+                 'primary_ip4': primary_ip4['address'] if primary_ip4 else None,
+                 'primary_ip4_id': primary_ip4['id'] if primary_ip4 else None}
+        snapshot['id'][entry['id']] = entry
+        snapshot['name'].setdefault(entry['name'], []).append(entry)
+        if entry['serial']:
+            snapshot['serial'][entry['serial']] = entry
+    return snapshot
+
+
+def match_snapshot_entry(device, payload, snapshot):
+    # NetBox device for a Catalyst Center device: the one with its
+    # serial, else the one of its name in its location, else of its
+    # name anywhere (only if there is just one); None if not in NetBox
+    serial = device.get('serialNumber')
+    if serial and serial in snapshot['serial']:
+        return snapshot['serial'][serial]
+    candidates = snapshot['name'].get(device['hostname'], [])
+    for entry in candidates:
+        if entry['location'] == payload.get('location'):
+            return entry
+    if len(candidates) == 1:
+        return candidates[0]
+    return None
+
+
+def diff_devices(devices, snapshot, nb, index, imp_locations,
+                 imp_devicetypes, location_ids=()):
+    # Compare Catalyst Center devices with the NetBox snapshot
+    # Devices are matched by serial, then by hostname (see
+    # match_snapshot_entry)
+    # Returns:
+    #   adds - CC devices not in NetBox
+    #   updates - [{'id': nb id, field: new value, ...}] changed fields only
+    #   ip_changes - [(nb id, CC device, replaced IP id or None)] where the
+    #     primary IP differs
+    #   stale - snapshot entries in 'location_ids' with no matching CC
+    #     device, limited to roles Catalyst Center reported (leaves e.g.
+    #     WLC-imported APs)
+    adds, updates, ip_changes = [], [], []
+    matched = set()
+    cc_roles = set()
+
+    for device in devices:
+        cc_roles.add(device['role'])
+        payload = build_device_payload(nb, device, imp_locations,
+                                       imp_devicetypes, index)
+        entry = match_snapshot_entry(device, payload, snapshot)
+        if entry is None or entry['id'] in matched:
+            adds.append(device)
+            continue
+        matched.add(entry['id'])
+
+        changes = {field: value for field, value in payload.items()
+                   if entry[field] != value}
+        if changes:
+            updates.append({'id': entry['id'], **changes})
+        if entry['primary_ip4'] != f"{device['managementIpAddress']}/32":
+            ip_changes.append((entry['id'], device, entry['primary_ip4_id']))
+
+    role_ids = {index.get('roles', name=role)['id'] for role in cc_roles
+                if index.get('roles', name=role) is not None}
+    stale = [entry for entry in snapshot['id'].values()
+             if entry['id'] not in matched and entry['role'] in role_ids
+             and entry['location'] in location_ids]
+    return adds, updates, ip_changes, stale
+
+
+def update_primary_ips(nb, ip_changes):
+    # Point existing devices at their new management IP
+    # Reuses each device's 'Management' interface, creating it if absent,
+    # with one bulk request per step; the replaced IP addresses are
+    # deleted once the devices no longer use them
+    device_ids = [device_id for device_id, _, _ in ip_changes]
+    interfaces = {interface['device']['id']: interface['id']
+                  for interface in nb.dcim.interfaces.filter(device_id=device_ids,
+                                                            name='Management')}
+    missing = [device_id for device_id in device_ids
+               if device_id not in interfaces]
+    if missing:
+        newints = nb.dcim.interfaces.create(
+            [{'name': 'Management',
+              'device': device_id,
+              'vdcs': [],
+              'type': 'virtual',
+              'enabled': True} for device_id in missing])
+        interfaces.update(zip(missing, [newint['id'] for newint in newints]))
+
+    newips = nb.ipam.ip_addresses.create(
+        [{'address': f"{device['managementIpAddress']}/32",
+          'assigned_object_type': 'dcim.interface',
+          'assigned_object_id': interfaces[device_id],
+          'status': 'reserved',
+          'role': 'vip'} for device_id, device, _ in ip_changes])
+    nb.dcim.devices.update(
+        [{'id': device_id, 'primary_ip4': newip['id']}
+         for (device_id, _, _), newip in zip(ip_changes, newips)])
+    replaced = [old_ip for _, _, old_ip in ip_changes if old_ip]
+    if replaced:
+        nb.ipam.ip_addresses.delete(replaced)
+
+
+def reconcile_devices(devices, nb, index, imp_locations, imp_devicetypes,
+                      prune=False, workers=0, chunk_size=500,
+                      incremental=False):
+    # Reconcile NetBox with the Catalyst Center inventory, sending only
+    # the deltas: new devices go through the normal import, changed
+    # fields and primary IPs are bulk updated, and devices NetBox has
+    # but Catalyst Center does not are deleted when 'prune' is set
+    # With 'incremental', 'devices' holds only the changed devices, so
+    # only those are looked up in NetBox and stale devices are not
+    # considered
+    # Returns a list of (hostname or chunk, error) for failed writes
+    devices = list(devices)
+    location_ids = set(imp_locations.values())
+    snapshot = get_nb_snapshot(nb, location_ids, devices,
+                               full=not incremental)
+    adds, updates, ip_changes, stale = diff_devices(devices, snapshot, nb,
+                                                    index, imp_locations,
+                                                    imp_devicetypes,
+                                                    location_ids)
+    if incremental:
+        stale = []
+    print(f"Reconcile: {len(adds)} to add, {len(updates)} to update, "
+          f"{len(ip_changes)} primary IP changes, {len(stale)} stale")
+
+    failures = []
+    if adds:
+        if workers > 0:
+            failures += import_devices_concurrent(adds, nb, index,
+                                                  imp_locations,
+                                                  imp_devicetypes,
+                                                  workers=workers)
+        else:
+            failures += import_devices(adds, nb, index, imp_locations,
+                                       imp_devicetypes,
+                                       chunk_size=chunk_size)
+    for chunk in chunked(updates, chunk_size):
+        try:
+            nb.dcim.devices.update(chunk)
+        except pynetbox.core.query.RequestError as e:
+            failures.append((f"update of {len(chunk)} devices", str(e.error)))
+    for chunk in chunked(ip_changes, chunk_size):
+        try:
+            update_primary_ips(nb, chunk)
+        except pynetbox.core.query.RequestError as e:
+            failures.append((f"primary IP of {len(chunk)} devices",
+                             str(e.error)))
+
+    if stale and prune:
+        for chunk in chunked(stale, chunk_size):
+            try:
+                nb.dcim.devices.delete([entry['id'] for entry in chunk])
+            except pynetbox.core.query.RequestError as e:
+                failures.append((f"removal of {len(chunk)} devices",
+                                 str(e.error)))
+        print(f"Removed stale devices: "
+              f"{', '.join(entry['name'] for entry in stale)}")
+    elif stale:
+        print(f"Stale devices kept (use --prune to remove): "
+              f"{', '.join(entry['name'] for entry in stale)}")
+
+    if failures:
+        print(f"Reconcile finished with {len(failures)} failed writes")
+    return failures
+
+
+def load_checkpoint(checkpointfile=CHECKPOINTFILE):
+    # Read the incremental sync checkpoint; empty if there is none yet
+    #   last_sync - epoch ms at the start of the last successful run
+    #   devices - {device UUID: {lastUpdateTime, reachabilityStatus}}
+    try:
+        with open(checkpointfile, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'last_sync': 0, 'devices': {}}
+
+
+def save_checkpoint(checkpoint, checkpointfile=CHECKPOINTFILE):
+    # Write the checkpoint atomically, so a crash never leaves half a file
+    tmpfile = f'{checkpointfile}.tmp'
+    with open(tmpfile, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(tmpfile, checkpointfile)
+
+
+def changed_since_checkpoint(devices, checkpoint, state):
+    # Yield only devices that are new or changed since the checkpoint
+    # The Catalyst Center device list has no 'changed since' filter, so
+    # every device is still listed, but only changed devices are passed
+    # on.  'state' collects the current per-device entries for the next
+    # checkpoint.
+    for device in devices:
+        current = {'lastUpdateTime': device.get('lastUpdateTime'),
+                   'reachabilityStatus': device.get('reachabilityStatus')}
+        state[device['id']] = current
+        if (checkpoint['devices'].get(device['id']) != current
+                or (device.get('lastUpdateTime') or 0) > checkpoint['last_sync']):
+            yield device
+
+
+def get_fuzzy_matches(device, candidates):
+    # Format the best NetBox device-type candidates for a platformId
+    # 'candidates' is the n-gram shortlist for this platformId; they are
+    # re-scored with fuzz.partial_ratio so the Match Factor column keeps
+    # its familiar 0-100 meaning, and the top 10 kept with a heap
+    tuples_list = heapq.nlargest(10,
+                                 ((device,
+                                   j['model'],
+                                   j['part_number'] or '',
+                                   j['id'],
+                                   fuzz.partial_ratio(device, j['part_number'] or ''))
+                                  for _, j in candidates),
+                                 key=lambda x: x[4])
 
     record = f"""  # For Catalyst Center platformId \"{device}\" modify 'CHANGE_ME' to a devicetypeId from
   # the known, supported NetBox device-types below or '99999' to create a new type
   #   Match    NetBox Known                                        NetBox Known
   #  _Factor_  _model name ______________________________________  _part number _____________ _(devicetypeId)_
 """
-    for item in tuples_list[0:10]:
+    for item in tuples_list:
         record += f"  #   {item[4]:>4}     {item[1]:50}  {item[2]:25}     {item[3]:>6}\n"
     record += f"  {device}: CHANGE_ME\n\n"
     
@@ -196,8 +689,29 @@ def get_fuzzy_matches(device, nb_devicetypes):
     return record
 
 
-def generate_devicemodel_mapping_file(cc_devices, nb_devicetypes):
+def get_mapped_keys(mapping_file):
+    # Return the device keys already present in a mapping file, or None
+    # if the file does not exist yet
+    if not os.path.isfile(mapping_file):
+        return None
+    # YAML may load keys such as platformIds as numbers; compare as text
+    return {str(key) for key in getparam('devices', envfile=mapping_file) or {}}
+
+
+def append_mapping_text(mapping_file, mapping_text):
+    # Append new entries to the end of an existing mapping file; the
+    # 'devices:' block is last, so appended entries fall inside it
+    with open(mapping_file, 'r+') as file1:
+        content = file1.read()
+        if content and not content.endswith('\n'):
+            file1.write('\n')
+        file1.writelines(mapping_text)
+
+
+def generate_devicemodel_mapping_file(cc_devices, nb_devicetypes,
+                                      merge=False):
     # Creates a CC device to NB device-model mapping
+    # With 'merge', the entries are appended to the existing file instead
     print(f"Several Catalyst Center device models need to be mapped "
           f"to known NetBox device-types.\nPlease refer to the newly "
           f"generated `DeviceModel_Mapping.yaml` file.\nEdit it to map "
@@ -205,61 +719,99 @@ def generate_devicemodel_mapping_file(cc_devices, nb_devicetypes):
     #print(f'Inside generate_devicemodel_mapping_file:\n{cc_devices}')
     unique_cc_devicetypes = {device for device in cc_devices}
     #print(unique_cc_devicetypes)
+
+    # Build the n-gram matrix of NetBox part numbers once and shortlist
+    # candidates for every platformId in one pass
+    matcher = NgramMatcher(nb_devicetypes, key='part_number')
+    shortlists = matcher.match_all(unique_cc_devicetypes, k=50)
     
-    device_mapping = """---
+    device_mapping = "" if merge else """---
 devices:
 """
     for devicetype in unique_cc_devicetypes:
-        device_mapping += get_fuzzy_matches(devicetype, nb_devicetypes)
+        device_mapping += get_fuzzy_matches(devicetype, shortlists[devicetype])
         #print(fuzzymatches)
     
+    if merge:
+        append_mapping_text("DeviceModel_Mapping.yaml", device_mapping)
+        return
     with open("DeviceModel_Mapping.yaml", "w") as file1:
         # Writing data to a file
         file1.writelines(device_mapping)
 
 
-def process_devicemodels(devices, nb):
+def process_devicemodels(devices, nb, merge=False):
     # Take devices information, extract device-models from CC understanding,
     # proposed nearest match of NetBox device-types based on fuzzy match
     cc_devicemodels = {f"{device['platformId']}" for device in devices}
     #print(cc_devicemodels)
+
+    mapped = get_mapped_keys("DeviceModel_Mapping.yaml") if merge else None
+    if mapped is not None:
+        # Only match platformIds not already in the file
+        cc_devicemodels -= mapped
+        if not cc_devicemodels:
+            print("No new Catalyst Center device models to map.")
+            return
+        print(f"{len(cc_devicemodels)} new device models to map.")
     
-    # Get all NetBox location
-    nb_devicetypes = list(nb.dcim.device_types.all())
-    generate_devicemodel_mapping_file(cc_devicemodels, nb_devicetypes)
+    # Get all NetBox device-types, from the local catalog cache
+    nb_devicetypes = get_devicetypes(nb)
+    generate_devicemodel_mapping_file(cc_devicemodels, nb_devicetypes,
+                                      merge=mapped is not None)
 
 
-def generate_location_mapping_file(devices, nb_locations):
+def generate_location_mapping_file(devices, nb_locations, merge=False):
     # Creates a CC device to NB location mapping
+    # With 'merge', only the device entries are appended to the existing
+    # file; its header of known locations is left as is
     print(f"Several Catalyst Center devices need to be mapped to known "
           f"NetBox locations and sites.\nPlease refer to the newly "
           f"generated `Location_Mapping.yaml` file.\nEdit it to map "
           f"device location to NetBox location (site).\n")
-    mapping_text = f"""---
+    mapping_text = ""
+    if not merge:
+        mapping_text = f"""---
 # The following NetBox locations, location Ids and sites are known.
 # Assign a location id to the Catalyst Center devices listed below.
 
 """
-    for location in nb_locations:
-        mapping_text += f"#Location `{location[0]:<32}` of site `{location[2]:<20}` is locationId {location[1]}\n"
+        for location in nb_locations:
+            mapping_text += f"#Location `{location[0]:<32}` of site `{location[2]:<20}` is locationId {location[1]}\n"
     
-    mapping_text += "\n\n#Catalyst Center devices\ndevices:\n"
+        mapping_text += "\n\n#Catalyst Center devices\ndevices:\n"
     for device in devices:
         mapping_text += f"  {device['hostname']}/{device['managementIpAddress']}: locationId\n"
 
     #print(mapping_text)
+    if merge:
+        append_mapping_text("Location_Mapping.yaml", mapping_text)
+        return
     with open("Location_Mapping.yaml", "w") as file1:
         # Writing data to a file
         file1.writelines(mapping_text)
 
 
-def process_sites(devices, nb):
+def process_sites(devices, nb, merge=False):
     # Take devices information, extract sites from CC understanding,
     # Extract all NetBox sites; compare; ask user to reconcile
     # mismatches and/or make missing sites
     #locations = [device['location'] for device in devices]
     #locations = {f"{device['locationName']}" for device in devices}
     #print(locations)
+
+    mapped = get_mapped_keys("Location_Mapping.yaml") if merge else None
+    if mapped is not None:
+        # Only list devices (hostname/IP) not already in the file
+        devices = [device for device in devices
+                   if f"{device['hostname']}/{device['managementIpAddress']}"
+                   not in mapped]
+        if not devices:
+            print("No new Catalyst Center devices to map to locations.")
+            return
+        print(f"{len(devices)} new devices to map to locations.")
+        generate_location_mapping_file(devices, None, merge=True)
+        return
     
     # Get all NetBox location
     nb_locations = list(nb.dcim.locations.all())
@@ -276,9 +828,7 @@ def process_sites(devices, nb):
     generate_location_mapping_file(devices, nb_locations)
 
 
-def get_cc_devices():
-    ccenv = getparam('CatalystCenter')
-
+def get_cc_session(ccenv):
     # Create a DNACenterAPI connection object
     dnac = api.DNACenterAPI(username=ccenv['DNA_CENTER_USERNAME'],
                             password=ccenv['DNA_CENTER_PASSWORD'],
@@ -287,13 +837,79 @@ def get_cc_devices():
                             ),
                             version=ccenv['DNA_CENTER_VERSION'],
                             verify=ccenv['DNA_CENTER_VERIFY'])
+    return dnac
 
-    # Find all devices that have 'Switches and Hubs' in their family
-    devices = dnac.devices.get_device_list(family='Switches and Hubs')
-    if len(devices['response']) > 0:
-        return devices['response']
-    else:
-        return None
+
+def get_cc_device_page(dnac, partition, offset, limit):
+    # Get one page of devices for a (family, site_id) partition
+    # Catalyst Center offsets are 1-based.  Without a site id the device
+    # list is used; with one, the site membership (which groups devices
+    # per site, including child sites) is flattened to a device list
+    # Returns (devices, page count), the page count being the number of
+    # records the page itself held (the largest site group for a
+    # membership page), to tell a full page from the last one
+    family, site_id = partition
+    if site_id is None:
+        devices = dnac.devices.get_device_list(family=family,
+                                               offset=offset,
+                                               limit=limit)
+        return devices['response'], len(devices['response'])
+    membership = dnac.sites.get_membership(site_id=site_id,
+                                           device_family=family,
+                                           offset=offset,
+                                           limit=limit)
+    groups = [group['response'] or [] for group in membership['device'] or []]
+    return ([device for group in groups for device in group],
+            max(map(len, groups), default=0))
+
+
+def get_cc_devices(dnac, families=('Switches and Hubs',), site_ids=(None,),
+                   page_size=500, workers=4):
+    # Generator of Catalyst Center devices, paged by offset/limit
+    # Every family x site id combination is a partition, paged on its
+    # own.  Up to 'workers' pages, taken round-robin from the partitions
+    # still returning full pages, are requested concurrently and yielded
+    # as they arrive, so the importer can start on the first page while
+    # later pages are still in flight and the whole collection is bound
+    # by the slowest partition.  A short (or empty) page marks the end of
+    # a partition.  Devices seen in more than one partition (eg. a
+    # parent and child site) are only yielded once, by device UUID.
+    # A single family or site id (eg. from the YAML file) is one value,
+    # not a sequence of characters
+    if isinstance(families, str):
+        families = [families]
+    if isinstance(site_ids, (str, int)):
+        site_ids = [site_ids]
+    active = deque((family, site_id) for family in families
+                   for site_id in site_ids)
+    next_offset = {partition: 1 for partition in active}
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def top_up():
+            while active and len(pending) < workers:
+                partition = active[0]
+                active.rotate(-1)
+                offset = next_offset[partition]
+                next_offset[partition] += page_size
+                pending[pool.submit(get_cc_device_page, dnac, partition,
+                                    offset, page_size)] = partition
+
+        top_up()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                partition = pending.pop(future)
+                page, page_count = future.result()
+                if page_count < page_size and partition in active:
+                    active.remove(partition)
+                for device in page:
+                    if device['id'] not in seen:
+                        seen.add(device['id'])
+                        yield device
+            top_up()
 
 
 def get_cli_args():
@@ -304,6 +920,27 @@ def get_cli_args():
                                     )
     parser.add_argument('--stage2', action='store_true',
                         help='Run Second Stage import process')
+    parser.add_argument('--merge', action='store_true',
+                        help='Add only new devices and models to existing '
+                        'mapping files instead of regenerating them')
+    parser.add_argument('--family', action='append', metavar='FAMILY',
+                        help='Catalyst Center device family to collect; '
+                        'repeat for several (default: Switches and Hubs)')
+    parser.add_argument('--site-id', action='append', metavar='SITE_ID',
+                        help='Catalyst Center site id to collect from; '
+                        'repeat for several (default: all sites)')
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help='Import devices with N concurrent workers '
+                        'during --stage2 (default: bulk stages)')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='During --stage2, only write differences '
+                        'between Catalyst Center and NetBox')
+    parser.add_argument('--prune', action='store_true',
+                        help='With --reconcile, delete devices no longer '
+                        'in Catalyst Center')
+    parser.add_argument('--incremental', action='store_true',
+                        help='During --stage2, reconcile only devices '
+                        'changed since the last successful sync')
     return parser.parse_args()
 
 
@@ -317,15 +954,26 @@ def main(args):
     Initiate session to NetBox
     Push to NetBox
     """
-    # Get list of devices from Catalyst Center
-    devices = get_cc_devices()
-    #print(devices)
+    # Get list of devices from Catalyst Center; a generator of pages
+    ccenv = getparam('CatalystCenter')
+    dnac = get_cc_session(ccenv)
+    families = (args.family or ccenv.get('families')
+                or ['Switches and Hubs'])
+    site_ids = args.site_id or ccenv.get('site_ids') or [None]
+    devices = get_cc_devices(dnac, families=families, site_ids=site_ids,
+                             page_size=ccenv.get('page_size', 500),
+                             workers=ccenv.get('page_workers', 4))
 
     # Initiate NetBox session
     nbenv = getparam('NetBox')
     # Create NetBox session
     session = requests.Session()
     session.verify = nbenv['verify_SSL']
+    if args.workers > 0:
+        # Allow one pooled connection per worker
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
     nb = pynetbox.api(f'{nbenv["scheme"]}://{nbenv["server"]}:{nbenv["port"]}',
                       token=nbenv["NETBOX_API_TOKEN"])
     nb.http_session = session
@@ -333,11 +981,16 @@ def main(args):
 
     if not args.stage2:
         # Initial run, generate mapping files
+        # Both mapping files walk the full inventory, so collect it once
+        devices = list(devices)
+        if not devices:
+            sys.exit('No devices found in Catalyst Center.  Exiting.')
+
         # Process Locations/Sites for NetBox
-        process_sites(devices, nb)
+        process_sites(devices, nb, merge=args.merge)
         
         # Process Device Types/Models for NetBox
-        process_devicemodels(devices, nb)
+        process_devicemodels(devices, nb, merge=args.merge)
 
         print('Re-run this script after editing Location_Mapping.yaml and '
             'DeviceModel_Mapping.yaml with:\n'
@@ -352,11 +1005,41 @@ def main(args):
         imp_devicetypes = getparam('devices', envfile='DeviceModel_Mapping.yaml')
         print(imp_devicetypes)
     
-        # Import Devices to NetBox
-        import_devices(devices, nb, imp_locations, imp_devicetypes)
-        
-        # Create Management IP Addresses and assignments for NetBox
-    
+        # Load NetBox roles, locations and manufacturers once
+        index = RefIndex(nb)
+
+        # Import Devices, Management interfaces and IPs to NetBox
+        if args.incremental:
+            # Checkpoint only advances once every NetBox write succeeded;
+            # otherwise the next run retries the same changes
+            run_started = int(time.time() * 1000)
+            checkpoint = load_checkpoint()
+            state = {}
+            changed = list(changed_since_checkpoint(devices, checkpoint,
+                                                    state))
+            print(f"{len(changed)} devices changed since last sync")
+            failures = reconcile_devices(changed, nb, index, imp_locations,
+                                         imp_devicetypes,
+                                         workers=args.workers,
+                                         chunk_size=nbenv.get('bulk_chunk_size', 500),
+                                         incremental=True)
+            if failures:
+                print('Checkpoint not advanced; re-run to retry.')
+            else:
+                save_checkpoint({'last_sync': run_started,
+                                 'devices': state})
+        elif args.reconcile:
+            reconcile_devices(devices, nb, index, imp_locations,
+                              imp_devicetypes, prune=args.prune,
+                              workers=args.workers,
+                              chunk_size=nbenv.get('bulk_chunk_size', 500))
+        elif args.workers > 0:
+            import_devices_concurrent(devices, nb, index, imp_locations,
+                                      imp_devicetypes, workers=args.workers)
+        else:
+            import_devices(devices, nb, index, imp_locations,
+                           imp_devicetypes,
+                           chunk_size=nbenv.get('bulk_chunk_size', 500))
 
 
 ########################################################################
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Persistent, incrementally refreshed NetBox device-type catalog
+ (dtCatalog.py)
+
+#                                                                      #
+Keeps an on-disk copy of the NetBox device-type catalog (normally the
+preloaded NetBox Community Device-Type Library, thousands of entries)
+so the mapping stages do not page through the whole catalog every run.
+
+The first run does a full load.  Later runs only ask NetBox for
+device-types changed since the newest 'last_updated' timestamp in the
+cache, then compare the merged count with NetBox's count; a mismatch
+(eg. device-types were deleted) triggers a full reload.  The cache
+records the NetBox API URL it was loaded from; a cache of another
+NetBox instance is reloaded in full, never reused.
+
+Required inputs/variables:
+    nb - pynetbox API session
+
+    Reads/writes the cache file, 'devicetype_catalog.json' by default
+    
+Outputs:
+    list of dictionaries with id, model, part_number, slug and
+    manufacturer (name) for every NetBox device-type
+
+Version log:
+v1   2026-1017  Initial development
+                Cache tied to the NetBox instance it was loaded from
+
+"""
+__version__ = '1'
+__author__ = 'Jason Davis - jadavis@cisco.com'
+__license__ = "'Apache License, Version 2.0 - ' \
+    'http://www.apache.org/licenses/LICENSE-2.0'"
+
+import json
+import os
+
+CACHEFILE = 'devicetype_catalog.json'
+
+
+def _entry(record):
+    """Reduce a pynetbox device-type record to the cached fields"""
+    record = dict(record)
+    return {'id': record['id'],
+            'model': record['model'],
+            'part_number': record.get('part_number') or '',
+            'slug': record['slug'],
+            'manufacturer': (record.get('manufacturer') or {}).get('name'),
+            'last_updated': record.get('last_updated')}
+
+
+def _load(cachefile):
+    """Read the cache file; None if missing or unreadable"""
+    try:
+        with open(cachefile, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save(cachefile, catalog):
+    """Write the cache file atomically (write temp file, then rename)"""
+    tmpfile = f'{cachefile}.tmp'
+    with open(tmpfile, 'w') as file:
+        json.dump(catalog, file)
+    os.replace(tmpfile, cachefile)
+
+
+def get_devicetypes(nb, cachefile=CACHEFILE):
+    """Get the NetBox device-type catalog, refreshing the local cache
+    
+    :param nb: NetBox session handler
+    :type nb: class 'pynetbox.core.api.Api'
+    :param str cachefile: path of the on-disk catalog cache
+    :returns: list of device-type dictionaries (id, model, part_number,
+        slug, manufacturer)
+    """
+    netbox = getattr(nb, 'base_url', None)
+    cache = _load(cachefile)
+    entries = None
+    if cache and cache.get('netbox') != netbox:
+        print(f"Device-type catalog cache is of another NetBox "
+              f"({cache.get('netbox')}), reloading.")
+        cache = None
+    if cache and cache.get('last_updated'):
+        # Incremental refresh - only device-types changed since the cache
+        entries = {entry['id']: entry for entry in cache['devicetypes']}
+        for record in nb.dcim.device_types.filter(last_updated__gte=cache['last_updated']):
+            entry = _entry(record)
+            entries[entry['id']] = entry
+        if len(entries) != nb.dcim.device_types.count():
+            print('Device-type catalog cache is out of step with NetBox, '
+                  'reloading.')
+            entries = None
+
+    if entries is None:
+        entries = {}
+        for record in nb.dcim.device_types.all():
+            entry = _entry(record)
+            entries[entry['id']] = entry
+
+    devicetypes = list(entries.values())
+    timestamps = [entry['last_updated'] for entry in devicetypes
+                  if entry['last_updated']]
+    _save(cachefile, {'netbox': netbox,
+                      'last_updated': max(timestamps, default=None),
+                      'devicetypes': devicetypes})
+    return devicetypes
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shared device-type mapping store (dtMapStore.py)
+
+#                                                                      #
+Keeps the mappings of imported device models (from CSV inventories,
+WLC AP models, etc.) to NetBox device-types in a single SQLite file,
+replacing the dt2nb_mapping.json and wlc2nb_mapping.json files.
+
+Each mapping is keyed by source system ('csv', 'wlc', ...) and the
+imported model name, so lookups are indexed rather than list scans.
+Writes are transactions, so the file is never left half-written, and
+SQLite's locking (WAL journal, busy timeout) lets several imports read
+and update the store at the same time.
+
+Mappings in the legacy JSON files - including files holding several
+concatenated JSON arrays from repeated sessions - are imported on first
+use and never overwrite mappings already in the store.
+
+Required inputs/variables:
+    dbfile - optional path of the SQLite file, 'dt_mappings.db' by
+        default
+
+Outputs:
+    dictionaries of imported model to NetBox device-type id
+
+Version log:
+v1   2026-1017  Initial development
+                Import each legacy JSON file only once
+
+"""
+__version__ = '1'
+__author__ = 'Jason Davis - jadavis@cisco.com'
+__license__ = "'Apache License, Version 2.0 - ' \
+    'http://www.apache.org/licenses/LICENSE-2.0'"
+
+import json
+import os.path
+import sqlite3
+
+DBFILE = 'dt_mappings.db'
+
+
+class DTMapStore:
+    """Device-type mappings by source system and imported model"""
+
+    def __init__(self, dbfile=DBFILE):
+        """Open (or create) the mapping store
+
+        :param str dbfile: path of the SQLite file
+        """
+        self.conn = sqlite3.connect(dbfile, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS dt_mappings (
+                                   source TEXT NOT NULL,
+                                   imported_model TEXT NOT NULL,
+                                   nb_model TEXT,
+                                   nb_dt_id INTEGER NOT NULL,
+                                   PRIMARY KEY (source, imported_model))''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS legacy_imports (
+                                   jsonfile TEXT PRIMARY KEY,
+                                   source TEXT NOT NULL,
+                                   mtime REAL NOT NULL)''')
+
+    def get(self, source, imported_model):
+        """Return the NetBox device-type id for a model, or None"""
+        row = self.conn.execute('SELECT nb_dt_id FROM dt_mappings '
+                                'WHERE source = ? AND imported_model = ?',
+                                (source, imported_model)).fetchone()
+        return row[0] if row else None
+
+    def mappings(self, source):
+        """Return all mappings of a source as {imported_model: nb_dt_id}"""
+        return dict(self.conn.execute('SELECT imported_model, nb_dt_id '
+                                      'FROM dt_mappings WHERE source = ?',
+                                      (source,)))
+
+    def missing(self, source, imported_models):
+        """Return the imported models that have no mapping yet"""
+        known = self.mappings(source)
+        return [model for model in imported_models if model not in known]
+
+    def add(self, source, mappings, replace=True):
+        """Add (or replace) mappings in a single transaction
+
+        :param str source: source system, eg. 'csv' or 'wlc'
+        :param mappings: iterable of (imported_model, nb_model, nb_dt_id)
+        :param bool replace: replace existing mappings of the same models;
+            when False existing mappings are kept
+        """
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        with self.conn:
+            self.conn.executemany(f'{verb} INTO dt_mappings (source, '
+                                  'imported_model, nb_model, nb_dt_id) '
+                                  'VALUES (?, ?, ?, ?)',
+                                  [(source, *mapping) for mapping in mappings])
+
+    def import_legacy_json(self, source, jsonfile, model_key):
+        """Import mappings from a legacy JSON mapping file, if present
+
+        The legacy files were appended to with one JSON array per
+        session, so every concatenated array is read.  A file is only
+        imported once (again only if it was modified since).
+
+        :param str source: source system the file belongs to
+        :param str jsonfile: legacy file, eg. 'wlc2nb_mapping.json'
+        :param str model_key: key of the imported model in each entry,
+            eg. 'wlc_model' or 'imported_model'
+        """
+        if not os.path.isfile(jsonfile):
+            return
+        mtime = os.path.getmtime(jsonfile)
+        imported = self.conn.execute('SELECT mtime FROM legacy_imports '
+                                     'WHERE jsonfile = ?',
+                                     (jsonfile,)).fetchone()
+        if imported and imported[0] == mtime:
+            return
+        with open(jsonfile, 'r') as file:
+            content = file.read()
+        decoder = json.JSONDecoder()
+        entries = []
+        position = 0
+        while position < len(content):
+            if content[position].isspace():
+                position += 1
+                continue
+            batch, position = decoder.raw_decode(content, position)
+            entries.extend(batch)
+        self.add(source, [(entry[model_key], entry.get('nb_model'),
+                           entry['nb_dt_id']) for entry in entries],
+                 replace=False)
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO legacy_imports '
+                              '(jsonfile, source, mtime) VALUES (?, ?, ?)',
+                              (jsonfile, source, mtime))
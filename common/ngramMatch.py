@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Batch character n-gram matcher for device-type catalogs
+ (ngramMatch.py)
+
+#                                                                      #
+Builds a sparse character n-gram matrix of a catalog (eg. NetBox
+device-types) once, then scores any number of queries (eg. Catalyst
+Center platformIds or WLC AP models) against every catalog entry with a
+sparse product, keeping only the top-k candidates per query on a heap.
+
+The matrix is held in inverted (column) form - for each n-gram, the
+catalog rows containing it and their weight - so a query only touches
+rows that share at least one n-gram with it.  Rows are L2 normalised,
+making the score the cosine similarity (0.0 - 1.0) of the n-gram sets.
+
+Required inputs/variables:
+    catalog - list of dictionaries (or objects supporting item access)
+    key - the catalog field to match against, eg. 'part_number'
+
+Outputs:
+    list of (score, catalog entry) tuples, best first
+
+Version log:
+v1   2026-1017  Initial development
+
+"""
+__version__ = '1'
+__author__ = 'Jason Davis - jadavis@cisco.com'
+__license__ = "'Apache License, Version 2.0 - ' \
+    'http://www.apache.org/licenses/LICENSE-2.0'"
+
+from collections import defaultdict
+import heapq
+import math
+
+
+def ngrams(text, n=3):
+    """Return the set of character n-grams of a string
+    
+    Text is upper-cased and padded with a space on both ends so short
+    strings and string boundaries still produce n-grams.
+
+    :param text: string to split (None is treated as empty)
+    :param n: n-gram length
+    :returns: set of n-gram strings
+    """
+    text = f" {(text or '').upper()} "
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramMatcher:
+    """Sparse n-gram index of a catalog, built once and queried in batch"""
+
+    def __init__(self, catalog, key='part_number', n=3):
+        """Build the n-gram matrix of the catalog
+
+        :param catalog: list of catalog entries
+        :param key: entry field holding the text to match against
+        :param n: n-gram length
+        """
+        self.catalog = list(catalog)
+        self.n = n
+        self.postings = defaultdict(list)
+        for row, entry in enumerate(self.catalog):
+            grams = ngrams(entry[key], n)
+            if not grams:
+                continue
+            weight = 1 / math.sqrt(len(grams))
+            for gram in grams:
+                self.postings[gram].append((row, weight))
+
+    def top_k(self, query, k=10):
+        """Score one query against the whole catalog
+
+        :param query: string to match
+        :param k: number of candidates to keep
+        :returns: up to k (score, catalog entry) tuples, best first
+        """
+        grams = ngrams(query, self.n)
+        scores = defaultdict(float)
+        if grams:
+            query_weight = 1 / math.sqrt(len(grams))
+            for gram in grams:
+                for row, weight in self.postings.get(gram, ()):
+                    scores[row] += weight * query_weight
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self.catalog[row]) for row, score in best]
+
+    def match_all(self, queries, k=10):
+        """Score many queries in one pass
+
+        :param queries: iterable of strings to match
+        :param k: number of candidates to keep per query
+        :returns: dictionary of query to its top_k() result
+        """
+        return {query: self.top_k(query, k) for query in queries}
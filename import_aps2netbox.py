@@ -7,12 +7,37 @@ Site information
 
 Required Inputs or Command-Line Arguments
     WLC and NetBox API creds should be defined in .env
+    A WLC entry may set 'ap_batch', the APs read per NETCONF request
+    (default 250), 'timeout', its NETCONF connection and per-request
+    timeout in seconds (default 45), and 'deadline', the seconds a whole
+    read of its APs may take (default 600)
+    WLC_POLL_WORKERS sets how many WLCs are polled at once (default 8)
+    -d, --daemon     keep running, polling every --interval seconds
+                     (default 60) over persistent sessions and sending
+                     only the AP changes (create/update/offline)
+    -s, --subscribe  keep running on a yang-push subscription, on-change
+                     or periodic (every --interval seconds), applying
+                     each notification as AP changes
+    -n, --notification FILE...
+                     apply yang-push notification files offline and
+                     print the AP changes (samples in
+                     examples/notifications)
 
 Outputs:
     define here
 
 Version log
 v1    2024-0418  Initial development
+v2    2026-1017  Use cached device-type catalog
+                 Keep mappings in the shared SQLite mapping store
+                 Single-pass AP data extraction
+                 Parse WLC reply once into an indexed AP record set
+                 Batched, incrementally parsed AP retrieval
+                 Concurrent WLC polling
+                 Daemon mode with persistent sessions, AP deltas
+                 yang-push subscription mode
+                 Cached NetBox lookups across AP changes, offline
+                 notification replay (--notification)
 #                                                                      #
 
 Copyright 2024 Cisco Systems
@@ -33,7 +58,7 @@ Credits:
 TBD
 """
 
-__version__ = '1'
+__version__ = '2'
 __author__ = 'Jason Davis - jadavis@cisco.com'
 __license__ = 'Apache License, Version 2.0 - ' \
     'http://www.apache.org/licenses/LICENSE-2.0'
@@ -46,8 +71,13 @@ import os
 from dotenv import dotenv_values
 import json
 
+import queue
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import lxml.etree as et
+from xml.sax.saxutils import escape
 from argparse import ArgumentParser
 from ncclient import manager
 from ncclient.operations import RPCError
@@ -62,26 +92,198 @@ from pprint import pprint
 from fuzzywuzzy import fuzz
 import re
 
+from common.dtCatalog import get_devicetypes
+from common.dtMapStore import DTMapStore
+
 # Global variables for script - do not change
 # GLOBALVAR = Null
 
+# YANG namespace of the WLC AP operational data
+AP_NS = 'http://cisco.com/ns/yang/Cisco-IOS-XE-wireless-access-point-oper'
+CAPWAP_DATA = f'{{{AP_NS}}}capwap-data'
+# capwap-data leaf (by tag) to AP record field
+AP_FIELDS = {f'{{{AP_NS}}}{leaf}': field for leaf, field in (
+    ('name', 'ap_name'),
+    ('wtp-mac', 'wtp_mac'),
+    ('ip-addr', 'ip_addr'),
+    ('wtp-serial-num', 'wtp_serial_num'),
+    ('wtp-enet-mac', 'wtp_enet_mac'),
+    ('radio-slots-in-use', 'radio_slots'),
+    ('model', 'model'),
+    ('num-slots', 'num_slots'),
+    ('sw-version', 'sw_version'),
+    ('location', 'location'),
+    ('resolved-policy-tag', 'r_policy_tag'),
+    ('resolved-site-tag', 'r_site_tag'),
+    ('resolved-rf-tag', 'r_rf_tag'),
+    ('site-tag-name', 'site_tag_name'),
+    ('ap-profile', 'ap_profile'),
+    ('rf-tag-name', 'rf_tag_name'),
+)}
+WTP_MAC = f'{{{AP_NS}}}wtp-mac'
+# APs fetched per NETCONF request, see get_ap_records()
+AP_BATCH = 250
+# Characters of a reply fed to the incremental XML parser at a time
+FEED_SIZE = 65536
+# Default NETCONF connection/request timeout (seconds) per WLC
+NETCONF_TIMEOUT = 45
+# Default time (seconds) a complete batched AP read of one WLC may take
+WLC_POLL_DEADLINE = 600
+# Default number of WLCs polled at the same time
+WLC_POLL_WORKERS = 8
+# Daemon mode reconnect backoff (seconds), doubling per failed attempt
+RECONNECT_MIN = 5
+RECONNECT_MAX = 300
+# AP names per name-filtered NetBox list request
+NB_FILTER_BATCH = 100
+# yang-patch edits of on-change notifications, and the capwap-data list
+# key in their targets, eg. /capwap-data[wtp-mac='00:11:22:33:44:50']
+YANG_PATCH_NS = 'urn:ietf:params:xml:ns:yang:ietf-yang-patch'
+YANG_PATCH_EDIT = f'{{{YANG_PATCH_NS}}}edit'
+YANG_PATCH_OPERATION = f'{{{YANG_PATCH_NS}}}operation'
+YANG_PATCH_TARGET = f'{{{YANG_PATCH_NS}}}target'
+YANG_PATCH_VALUE = f'{{{YANG_PATCH_NS}}}value'
+WTP_MAC_KEY = re.compile(r'capwap-data\[(?:[\w-]+:)?wtp-mac=[\'"]([^\'"]+)[\'"]\]')
+
 
 ###############################################################################
 # ####### Class definitions
-'''
-class MyClass:
-    """A simple example class"""
-    i = 12345
 
-    def f(self):
-        return 'hello world'
+class APRecord:
+    """One access point as reported by a WLC (a capwap-data entry)
 
+    Fields are the values of AP_FIELDS plus the WLC name; slots keep the
+    per-AP footprint small on controllers with thousands of APs.
+    """
+    __slots__ = (*AP_FIELDS.values(), 'wlc')
 
-class Complex:
-    def __init__(self, realpart, imagpart):
-        self.r = realpart
-        self.i = imagpart
-'''
+    def __init__(self, wlc=None, **fields):
+        for field in AP_FIELDS.values():
+            setattr(self, field, fields.get(field))
+        self.wlc = wlc
+
+    def __repr__(self):
+        return f'APRecord({self.ap_name!r}, {self.model!r}, {self.wlc!r})'
+
+    def values(self):
+        # All field values, to compare two polls of the same AP
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+
+class APRecordSet:
+    """The APs of one WLC, parsed once from its NETCONF reply
+
+    Holds the APRecords in reply order with indexes by AP name, model
+    and site tag, so each processing stage reads from the same parsed
+    records instead of re-parsing the XML.
+    """
+    def __init__(self, records):
+        self.records = list(records)
+        self.by_name = {}
+        self.by_model = {}
+        self.by_site_tag = {}
+        for record in self.records:
+            self.by_name[record.ap_name] = record
+            self.by_model.setdefault(record.model, []).append(record)
+            self.by_site_tag.setdefault(record.site_tag_name, []).append(record)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_xml(cls, apdata, wlc):
+        """Parse the WLC AP data XML into an AP record set
+
+        :param xmlstr apdata: String of XML data extracted from WLC about
+            AP data
+        :param dict wlc: Wireless LAN Controller the data came from
+
+        :rtype: APRecordSet
+        """
+        return cls(iter_ap_records(apdata, wlc))
+
+
+class WLCSession:
+    """Long-lived NETCONF session to one WLC, for daemon mode
+
+    The session is opened on first use and kept across polls, so each
+    poll costs only the RPCs, not an SSH key exchange and capability
+    negotiation.  When a poll fails the session is dropped and not
+    retried before a backoff delay, which doubles with every failed
+    attempt (RECONNECT_MIN to RECONNECT_MAX seconds).
+    """
+    def __init__(self, wlc):
+        self.wlc = wlc
+        self.m = None
+        self.backoff = 0
+        self.retry_at = 0
+
+    def poll(self):
+        """Read all APs of the WLC over the session
+
+        :return: the APs, or None if the WLC could not be read (or is
+            waiting out its reconnect backoff)
+        :rtype: APRecordSet or None
+        """
+        name = self.wlc['name']
+        if time.monotonic() < self.retry_at:
+            return None
+        try:
+            if self.m is None or not self.m.connected:
+                print(f"Connecting to WLC {name}")
+                self.m = connect_wlc(self.wlc)
+            aps = APRecordSet(read_ap_records(
+                self.m, self.wlc, int(self.wlc.get('ap_batch', AP_BATCH))))
+        except Exception as e:
+            self.close()
+            self.backoff = min(max(self.backoff * 2, RECONNECT_MIN),
+                               RECONNECT_MAX)
+            self.retry_at = time.monotonic() + self.backoff
+            print(f"Polling WLC {name} failed ({e!r}); retrying in "
+                  f"{self.backoff} seconds")
+            return None
+        self.backoff = 0
+        return aps
+
+    def close(self):
+        if self.m is not None:
+            try:
+                self.m.close_session()
+            except Exception:
+                pass
+            self.m = None
+
+
+class NBLookups:
+    """NetBox lookups kept across AP changes, for the long-running modes
+
+    Holds one NetBox session, the location ids by name and the WLC model
+    to device-type mapping resolved so far.  An AP change then costs only
+    the requests for its own device, plus the lookups of a site tag or
+    model not seen before; not a read of every site, location or AP.
+    """
+    def __init__(self, netbox):
+        self.nb = get_nb_session(netbox)
+        self.locations = {}
+        self.model_mapping = {}
+
+    def prepare(self, aps):
+        """Make sure the locations and device types of 'aps' are known
+
+        :param APRecordSet aps: AP records about to be sent to NetBox
+        """
+        site_tags = [tag for tag in aps.by_site_tag
+                     if tag not in self.locations]
+        if site_tags:
+            do_location_work(self.nb, APRecordSet(
+                record for tag in site_tags for record in aps.by_site_tag[tag]))
+            self.locations.update(get_nb_locations(self.nb, site_tags))
+        if any(model not in self.model_mapping for model in aps.by_model):
+            do_device_model_work(self.nb, aps)
+            self.model_mapping = DTMapStore().mappings('wlc')
 
 
 ###############################################################################
@@ -108,6 +310,47 @@ def TEMPLATE_function(sender, recipient, message_body, priority=1) -> int:
 
 ####
 
+def iter_elements(xml, tag):
+    """Incrementally parse XML, yielding each complete 'tag' element
+
+    The document is fed to a pull parser in FEED_SIZE pieces and every
+    element is cleared (and dropped from its parent) once the caller is
+    done with it, so the parsed tree never grows beyond one element.
+
+    :param xmlstr xml: XML document
+    :param str tag: tag (in {namespace}name form) of the elements to yield
+    """
+    parser = et.XMLPullParser(events=('end',), tag=tag)
+    for start in range(0, len(xml), FEED_SIZE):
+        # Fed as bytes, as the reply carries an encoding declaration
+        parser.feed(xml[start:start + FEED_SIZE].encode('utf-8'))
+        for _, element in parser.read_events():
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    parser.close()
+
+
+def iter_ap_records(apdata, wlc):
+    """Yield an APRecord per capwap-data element of the WLC AP data XML
+
+    Each capwap-data element is walked once as soon as it is complete,
+    picking up the fields of AP_FIELDS by element tag as they go by (the
+    first one of each in document order).
+
+    :param xmlstr apdata: String of XML data extracted from WLC about AP data
+    :param dict wlc: Wireless LAN Controller the data came from
+    """
+    for capwap in iter_elements(apdata, CAPWAP_DATA):
+        fields = {}
+        for element in capwap.iter():
+            field = AP_FIELDS.get(element.tag)
+            if field is not None and field not in fields:
+                fields[field] = element.text or ''
+        yield APRecord(wlc=wlc['name'], **fields)
+
+
 def create_devices_in_netbox(nb, records, model_maps, wlc):
     """Create devices in NetBox
     
@@ -125,9 +368,9 @@ def create_devices_in_netbox(nb, records, model_maps, wlc):
     
     :param NBSession nb: NetBox session
     :param records: The AP data records
-    :type records: List[JSON]
+    :type records: List[APRecord]
     :param model_maps: The device types/models mapped between WLC and NetBox
-    :type model_maps: List[dictionary]
+    :type model_maps: dict of WLC model to NetBox device-type id
     :param wlc: dictionary of Wireless LAN Controller configuration
     :type wlc: List[dictionary]
 
@@ -146,10 +389,9 @@ def create_devices_in_netbox(nb, records, model_maps, wlc):
     print(model_maps)
     nb_device_records = []
     for device in records:
-        name = device['ap_name']
-        print(device['model'])
-        device_type = [mapping['nb_dt_id'] for mapping in model_maps
-                       if mapping['wlc_model'] == device['model']][0]
+        name = device.ap_name
+        print(device.model)
+        device_type = model_maps[device.model]
         #print(device_type)
         role = nb.dcim.device_roles.get(slug='wireless-access-point').id
         #print(role)
@@ -172,13 +414,13 @@ def create_devices_in_netbox(nb, records, model_maps, wlc):
         specific statuses), primary_ip4(int - mapping previously created),
         description(str), comments(str), tags(see docs), 
         custom_fields(see docs)"""
-        serial = device['wtp_serial_num']
+        serial = device.wtp_serial_num
         asset_tag = None
-        location = nb.dcim.locations.get(name=device['site_tag_name'])
+        location = nb.dcim.locations.get(name=device.site_tag_name)
         if location is None:
             # Create location
-            location = nb.dcim.locations.create(dict(name=device['site_tag_name'],
-                                                     slug=slugify(device['site_tag_name'])
+            location = nb.dcim.locations.create(dict(name=device.site_tag_name,
+                                                     slug=slugify(device.site_tag_name)
                                                     )
                                                 )
         locationid = location.id
@@ -187,7 +429,7 @@ def create_devices_in_netbox(nb, records, model_maps, wlc):
         
         # tags - set custom site tag for WLC and site-tag
         custom_wlc = wlc['name']
-        custom_sitetag = device['site_tag_name']
+        custom_sitetag = device.site_tag_name
         
         # Create device
         nbdevice = nb.dcim.devices.create(name=name,
@@ -206,7 +448,7 @@ def create_devices_in_netbox(nb, records, model_maps, wlc):
         
         #Create IP address and associate to newly created device
         # Management IP Address work
-        mgmt_ip = device['ip_addr']
+        mgmt_ip = device.ip_addr
         # Get AP Device GigabitEthernet0 interface id
         interfaceid = nb.dcim.interfaces.get(name='GigabitEthernet0', device=name).id
         print(interfaceid)
@@ -225,11 +467,9 @@ def create_devices_in_netbox(nb, records, model_maps, wlc):
                                                 'primary_ip4': ip_create_results.id}])
         print(updatedevice)
 
-    exit()
-
 
-def extract_ap_data(nb, wlc, missing_aps, apdata):
-    """Extract AP data from WLC apdata XML; create records
+def extract_ap_data(nb, wlc, missing_aps, aps):
+    """Extract AP data of the missing APs from the WLC AP records
     
     Create the missing APs in NetBox; use device name, model, location
     and management IP address; tag with WLC
@@ -237,96 +477,15 @@ def extract_ap_data(nb, wlc, missing_aps, apdata):
     :param NBSession nb: NetBox session
     :param str wlc: Wireless LAN Controller friendly name
     :param list missing_aps: List of strings representing missing APs to add
-    :param xmlstr apdata: String of XML data extracted from WLC about AP data
+    :param APRecordSet aps: AP records of the WLC
 
-    :return: the message id
-    :rtype: int
-    :raises ValueError: if the message_body exceeds 160 characters
-    :raises TypeError: if the message_body is not a basestring
+    :return: AP records of the missing APs
+    :rtype: list of APRecord
     """
-    # For each missing AP: Extract AP record (capwap-data branch) from 
-    # XML data
-    root = et.fromstring(bytes(apdata, encoding='utf-8'))
-    ap_records = []
-    for ap in missing_aps:
-        #print(ap)
-        ns = {"ns":"http://cisco.com/ns/yang/Cisco-IOS-XE-wireless-access-point-oper"}
-        ap_record = root.xpath(f'.//ns:name[text()="{ap}"]', 
-                               namespaces=ns)[0].getparent()
-        #print(et.tostring(ap_record))
-
-        wtp_mac = et.tostring(ap_record.xpath(f'.//ns:wtp-mac', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        ip_addr = et.tostring(ap_record.xpath(f'.//ns:ip-addr', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        wtp_serial_num = et.tostring(ap_record.xpath(f'.//ns:wtp-serial-num',
-                                     namespaces=ns)[0], pretty_print=True, 
-                                     encoding=str, method='text')
-        wtp_enet_mac = et.tostring(ap_record.xpath(f'.//ns:wtp-enet-mac', 
-                                   namespaces=ns)[0], pretty_print=True, 
-                                   encoding=str, method='text')
-        radio_slots = et.tostring(ap_record.xpath(f'.//ns:radio-slots-in-use', 
-                                  namespaces=ns)[0], pretty_print=True, 
-                                  encoding=str, method='text')
-        model = et.tostring(ap_record.xpath(f'.//ns:model', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        num_slots = et.tostring(ap_record.xpath(f'.//ns:num-slots', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        sw_version = et.tostring(ap_record.xpath(f'.//ns:sw-version', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        location = et.tostring(ap_record.xpath(f'.//ns:location', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        r_policy_tag = et.tostring(ap_record.xpath(f'.//ns:resolved-policy-tag', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        r_site_tag = et.tostring(ap_record.xpath(f'.//ns:resolved-site-tag', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        r_rf_tag = et.tostring(ap_record.xpath(f'.//ns:resolved-rf-tag', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        site_tag_name = et.tostring(ap_record.xpath(f'.//ns:site-tag-name', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        ap_profile = et.tostring(ap_record.xpath(f'.//ns:ap-profile', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        rf_tag_name = et.tostring(ap_record.xpath(f'.//ns:rf-tag-name', namespaces=ns)[0],
-                              pretty_print=True, encoding=str,
-                              method='text')
-        """print(wtp_mac, ip_addr, wtp_serial_num, wtp_enet_mac, radio_slots,
-              model, num_slots, sw_version, location, r_policy_tag,
-              r_site_tag, r_rf_tag, site_tag_name, ap_profile, rf_tag_name)"""
-        ap_dict = {'ap_name': ap,
-                   'wtp_mac': wtp_mac, 
-                   'ip_addr': ip_addr, 
-                   'wtp_serial_num': wtp_serial_num, 
-                   'wtp_enet_mac': wtp_enet_mac, 
-                   'radio_slots': radio_slots,
-                   'model': model, 
-                   'num_slots': num_slots, 
-                   'sw_version': sw_version, 
-                   'location': location,
-                   'r_policy_tag': r_policy_tag,
-                   'r_site_tag': r_site_tag, 
-                   'r_rf_tag': r_rf_tag, 
-                   'site_tag_name': site_tag_name, 
-                   'ap_profile': site_tag_name, 
-                   'rf_tag_name': rf_tag_name,
-                   'wlc': wlc["name"]
-                   }
-        ap_records.append(ap_dict)
-        
-    return ap_records
+    return [aps.by_name[ap] for ap in missing_aps]
 
 
-def create_dt_mappings(nb_devicetypes, ap_models, nb):
+def create_dt_mappings(nb_devicetypes, ap_models, nb, store):
     """Create Device Type Mappings
     
     The Device Type names from the NetBox Community Device Type project
@@ -339,6 +498,7 @@ def create_dt_mappings(nb_devicetypes, ap_models, nb):
         names
     :param list ap_models: The AP model types extracted from the WLC
     :param NBSessionHandler nb: NetBox session handler
+    :param DTMapStore store: device-type mapping store to update
 
     :return: mapping of WLC types to NB name and id
     :rtype: list of dictionaries
@@ -399,13 +559,14 @@ def create_dt_mappings(nb_devicetypes, ap_models, nb):
         print("-" * 40)
 
     if fileupdates:
-        with open('wlc2nb_mapping.json', 'a') as file:
-            json.dump(fileupdates, file)
+        store.add('wlc', [(update['wlc_model'], update['nb_model'],
+                           update['nb_dt_id']) for update in fileupdates])
     #print(tuples_list)
+    return fileupdates
 
 
 ################
-def do_device_work(nb, wlc, apdata, model_maps):
+def do_device_work(nb, wlc, aps, model_maps):
     """Do the NetBox device work - extract device information from WLC info,
     compare and create new
     
@@ -415,15 +576,15 @@ def do_device_work(nb, wlc, apdata, model_maps):
 
     :param session nb: NetBox session handler
     :param str wlc: WLC friendly name
-    :param str apdata: String of XML data representing AP parameters
+    :param APRecordSet aps: AP records of the WLC
     :param model_maps: The mapping of WLC derived device models to
         NetBox known device types (with associated id (int))
-    :type model_maps: List[JSON]
+    :type model_maps: dict
 
     """
-    nb_devicenames = [device.name for device in list(nb.dcim.devices.filter(role='wireless-access-point'))]
-    root = et.fromstring(bytes(apdata, encoding='utf-8'))
-    learned_ap_names = set(root.xpath("//*[local-name()='name']/text()"))
+    # Only the learned APs are looked up, not every AP in NetBox
+    learned_ap_names = set(aps.by_name)
+    nb_devicenames = set(get_nb_aps(nb, learned_ap_names))
     print(learned_ap_names)
 
     # Look to see if the device(s) is/are already in NetBox
@@ -433,41 +594,12 @@ def do_device_work(nb, wlc, apdata, model_maps):
     print(f"Known AP(s): {known_aps}")
     
     # Create missing APs
-    ap_results = extract_ap_data(nb, wlc, missing_aps, apdata)
+    ap_results = extract_ap_data(nb, wlc, missing_aps, aps)
     #print(ap_results)
     create_devices_in_netbox(nb, ap_results, model_maps, wlc)
-    exit()
-    create_results = import_to_netbox(ap_results)
-    nb_locationnames = [location.name for location in list(nb.dcim.locations.all())]
-    print(nb_sitenames)
-    print(nb_locationnames)
-    # Get all site/locations (as site-tags) from WLC AP data
-    root = et.fromstring(bytes(apdata, encoding='utf-8'))
-    site_tags = set(root.xpath("//*[local-name()='site-tag-name']/text()"))
-    print(site_tags)
-    missing_locations = [site for site in site_tags
-                         if site not in nb_locationnames]
-    if not missing_locations:
-        # No missing sites to configure
-        print("No missing Locations to import")
-    else:
-        # We have missing Locations to add to NetBox
-        print(f"Missing Locations(s): {missing_locations}")
-        print(f"The following Sites exist: {",".join(nb_sitenames)}")
-        for location in missing_locations:
-            site4location = input(f"Enter Site to associate with {location}: ")
-            siteid = nb.dcim.sites.get(name=site4location).id
-            new_location = nb.dcim.locations.create(dict(
-                name=location,
-                slug=slugify(location),
-                site=siteid
-            ))
-            print(new_location)
-            print(f"Created Location \"{new_location.name}\" with following results -")
-            pprint(dict(new_location), indent=4)
 
 
-def do_device_model_work(nb, apdata):
+def do_device_model_work(nb, aps):
     """Do the NetBox site work - extract device models, compare and create new
     
     Extract current device model list from NetBox, compare with device
@@ -483,38 +615,28 @@ def do_device_model_work(nb, apdata):
     user input is needed going forward.
 
     :param session nb: NetBox session handler
-    :param str apdata: String of XML data representing AP parameters
+    :param APRecordSet aps: AP records of the WLC
 
     """
     print('Got to do_device_model_work')
     # Get all wireless AP model types from WLC AP data
-    root = et.fromstring(bytes(apdata, encoding='utf-8'))
-    ap_models = set(root.xpath("//*[local-name()='model']/text()"))
+    ap_models = set(aps.by_model)
     
-    original_content = None
-    try:
-        with open('wlc2nb_mapping.json', 'r') as file:
-            original_content = json.load(file)
-    except FileNotFoundError:
-        # No previous mapping file, so safe to assume we've never done
-        # this process
-        pass
-    else:
-        print(original_content)
-        missing_dts = [device_type for device_type in ap_models
-                       if not any(model['wlc_model'] == device_type 
-                       for model in original_content)]
-        print(missing_dts)
-        if not missing_dts:
-            return
-
-    nb_devicetype_names = [dt.model for dt in list(nb.dcim.device_types.all())]
+    store = DTMapStore()
+    # Carry over mappings from the legacy JSON file, if there is one
+    store.import_legacy_json('wlc', 'wlc2nb_mapping.json', 'wlc_model')
+    missing_dts = store.missing('wlc', ap_models)
+    print(missing_dts)
+    if not missing_dts:
+        return
+
+    nb_devicetype_names = [dt['model'] for dt in get_devicetypes(nb)]
     #print(nb_devicetype_names)
     #print(ap_models)
-    create_dt_mappings(nb_devicetype_names, ap_models, nb)
+    create_dt_mappings(nb_devicetype_names, missing_dts, nb, store)
 
 
-def do_location_work(nb, apdata):
+def do_location_work(nb, aps):
     """Do the NetBox site/location work - extract sites and locations,
     compare and create new
     
@@ -529,17 +651,15 @@ def do_location_work(nb, apdata):
     spaces in a 'hall', etc.)
 
     :param session nb: NetBox session handler
-    :param str apdata: String of XML data representing AP parameters
+    :param APRecordSet aps: AP records of the WLC
 
     """
-    nb_sitenames = [site.name for site in list(nb.dcim.sites.all())]
-    nb_locationnames = [location.name for location in list(nb.dcim.locations.all())]
-    print(nb_sitenames)
-    print(nb_locationnames)
-    # Get all site/locations (as site-tags) from WLC AP data
-    root = et.fromstring(bytes(apdata, encoding='utf-8'))
-    site_tags = set(root.xpath("//*[local-name()='site-tag-name']/text()"))
+    # Get all site/locations (as site-tags) from WLC AP data; only those
+    # are looked up in NetBox, not every location
+    site_tags = set(aps.by_site_tag)
     print(site_tags)
+    nb_locationnames = set(get_nb_locations(nb, site_tags))
+    print(nb_locationnames)
     missing_locations = [site for site in site_tags
                          if site not in nb_locationnames]
     if not missing_locations:
@@ -547,8 +667,9 @@ def do_location_work(nb, apdata):
         print("No missing Locations to import")
     else:
         # We have missing Locations to add to NetBox
+        nb_sitenames = [site.name for site in list(nb.dcim.sites.all())]
         print(f"Missing Locations(s): {missing_locations}")
-        print(f"The following Sites exist: {",".join(nb_sitenames)}")
+        print(f"The following Sites exist: {','.join(nb_sitenames)}")
         for location in missing_locations:
             site4location = input(f"Enter Site to associate with {location} [or 'NEW' if a new site is needed]: ")
             if site4location == 'NEW':
@@ -568,7 +689,7 @@ def do_location_work(nb, apdata):
             pprint(dict(new_location), indent=4)
 
 
-def do_netbox_work(netbox: dict[str], wlc: str, apdata: str):
+def do_netbox_work(netbox: dict[str], wlc: str, aps: APRecordSet):
     """Parent function to call all NetBox work
     
     Parent function that takes in the WLC AP information and processes 
@@ -577,36 +698,63 @@ def do_netbox_work(netbox: dict[str], wlc: str, apdata: str):
     :param dict netbox: Dictionary with NetBox environment parameters
     :param str wlc: Friendly name of the Wireless LAN Controller to
         associate/tag in NetBox
-    :param str apdata: XML formatted data representing the AP info
+    :param APRecordSet aps: AP records of the WLC, parsed once; every
+        stage works from these records
 
     :return: the message id
     :rtype: int
     """
     # Do initial NetBox connection
-    session = requests.Session()
-    session.verify = False
-    nb = pynetbox.api(f"{netbox['NETBOX_SCHEME']}://{netbox['NETBOX_HOST']}:{netbox['NETBOX_PORT']}",
-                      token=netbox["NETBOX_APIKEY"])
-    nb.http_session = session
+    nb = get_nb_session(netbox)
     #print(nb.status())
     
     # Process Site/Location info - any new Locations to create in NB?
-    do_location_work(nb, apdata)
+    do_location_work(nb, aps)
     # 
     # Process Device Model info - any new Device Models to create in
     # NB?  Note: this has an interactive component to associate known
     # device models with that passed in
-    do_device_model_work(nb, apdata)
+    do_device_model_work(nb, aps)
     
-    # Read final mapping file and return
-    with open('wlc2nb_mapping.json', 'r') as file:
-        model_mapping = json.load(file)
+    # Read final mappings from the mapping store
+    model_mapping = DTMapStore().mappings('wlc')
     
     print('Got here')
     print(model_mapping)
     #
     # Process actual device imports
-    do_device_work(nb, wlc, apdata, model_mapping)
+    do_device_work(nb, wlc, aps, model_mapping)
+
+
+def connect_wlc(device):
+    """Open a NETCONF session to a WLC
+
+    :param dict device: WLC host, port and credentials, optionally the
+        'timeout' (seconds) of the connection and of each request
+    :return: ncclient manager, to be used as a context manager
+    """
+    return manager.connect(host=device['host'],
+                           port=device['port'],
+                           username=device['username'],
+                           password=device['password'],
+                           timeout=int(device.get('timeout', NETCONF_TIMEOUT)),
+                           hostkey_verify=False,
+                           device_params={'name': 'iosxe'})
+
+
+def dispatch_rpc(m, xmlrpc):
+    """Execute a NETCONF RPC, passed in as XML, on an open session
+
+    :param m: ncclient manager (open session)
+    :param str xmlrpc: RPC request as XML
+    :return: the reply (or error reply) XML
+    :rtype: str
+    """
+    try:
+        response = m.dispatch(et.fromstring(xmlrpc))
+        return response.xml
+    except RPCError as e:
+        return e.xml
 
 
 def get_netconf_data(device, xmlrpc):
@@ -617,26 +765,9 @@ def get_netconf_data(device, xmlrpc):
     """
     # connect to netconf agent
     try:
-        with manager.connect(host=device['host'],
-                            port=device['port'],
-                            username=device['username'],
-                            password=device['password'],
-                            timeout=45,
-                            hostkey_verify=False,
-                            device_params={'name': 'iosxe'}) as m:
-
+        with connect_wlc(device) as m:
             # execute netconf operation
-            try:
-                response = m.dispatch(et.fromstring(xmlrpc))
-                data = response.xml
-            except RPCError as e:
-                data = e.xml
-                pass
-            except Exception as e:
-                traceback.print_exc()
-                exit(1)
-
-            return data
+            return dispatch_rpc(m, xmlrpc)
             '''
             # beautify output
             if et.iselement(data):
@@ -655,28 +786,24 @@ def get_netconf_data(device, xmlrpc):
             '''
             
     except errors.SSHError:
-            print(f'Unable to connect to device {device['name']}')
+            print(f"Unable to connect to device {device['name']}")
     except Exception as e:
         traceback.print_exc()
         exit(1)
 
 
-def get_aps_from_wlc(wlc):
-    """Get the wireless AP information from Cisco Wireless LAN Controller
-    
-    Use NETCONF RPC to query the Cisco-IOS-XE-Wireless-Access-Point-Oper
-    YANG model and extract information, such as AP name, serial, model,
-    management IP, etc
-    
-    :param dict wlc: Dictionary defining the WLC creds
-
-    """
-    payload = '''
+# NETCONF <get> of the AP operational data; {entries} is one or more
+# capwap-data entries (AP_ALL, AP_ENTRY or AP_KEYS)
+AP_GET_RPC = '''
 <get xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
   <filter>
-    <access-point-oper-data xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-wireless-access-point-oper">
-      <capwap-data>
-        <wtp-mac/>
+    <access-point-oper-data xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-wireless-access-point-oper">{entries}
+    </access-point-oper-data>
+  </filter>
+</get>
+'''
+# The capwap-data leaves read for each AP
+AP_SELECTION = '''
         <ip-addr/>
         <name/>
         <device-detail>
@@ -699,13 +826,555 @@ def get_aps_from_wlc(wlc):
         </device-detail>
         <ap-location/>
         <tag-info/>
-        <wtp-ip/>
-      </capwap-data>
-    </access-point-oper-data>
-  </filter>
-</get>
+        <wtp-ip/>'''
+# Every AP
+AP_ALL = f'''
+      <capwap-data>
+        <wtp-mac/>{AP_SELECTION}
+      </capwap-data>'''
+# Only the AP with radio MAC {wtp_mac} (content match on the list key)
+AP_ENTRY = '''
+      <capwap-data>
+        <wtp-mac>{wtp_mac}</wtp-mac>''' + AP_SELECTION + '''
+      </capwap-data>'''
+# Only the list keys (radio MACs) of all APs
+AP_KEYS = '''
+      <capwap-data>
+        <wtp-mac/>
+      </capwap-data>'''
+# IOS-XE yang-push subscription to all capwap-data; {trigger} is the
+# on-change dampening period or the periodic update period
+AP_SUBSCRIBE_RPC = '''
+<establish-subscription xmlns="urn:ietf:params:xml:ns:yang:ietf-event-notifications"
+                        xmlns:yp="urn:ietf:params:xml:ns:yang:ietf-yang-push">
+  <stream>yp:yang-push</stream>
+  <yp:xpath-filter>/wireless-access-point-oper:access-point-oper-data/capwap-data</yp:xpath-filter>
+  {trigger}
+</establish-subscription>
 '''
-    return get_netconf_data(wlc, payload)
+
+
+def get_aps_from_wlc(wlc):
+    """Get the wireless AP information from Cisco Wireless LAN Controller
+    
+    Use NETCONF RPC to query the Cisco-IOS-XE-Wireless-Access-Point-Oper
+    YANG model and extract information, such as AP name, serial, model,
+    management IP, etc
+    
+    :param dict wlc: Dictionary defining the WLC creds
+
+    """
+    return get_netconf_data(wlc, AP_GET_RPC.format(entries=AP_ALL))
+
+
+def read_ap_records(m, wlc, batch_size=AP_BATCH):
+    """Read the AP records of a WLC in batches, over an open session
+
+    A single <get> of all capwap-data can run to hundreds of MB on large
+    controllers.  Instead the list keys (wtp-mac) of all APs are read
+    first, then the AP data 'batch_size' APs at a time, filtering on the
+    keys.  Each reply is parsed incrementally and the APRecords are
+    yielded as they complete, so memory is bounded by the batch size,
+    not by the number of APs on the controller.
+
+    The 'timeout' of the session bounds each request only; the whole
+    read is bounded by the WLC's 'deadline' (WLC_POLL_DEADLINE), checked
+    between batches.  Any failure is raised, never a partial read, as
+    callers treat the APs read as everything the WLC has.
+
+    :param m: ncclient manager (open session to the WLC)
+    :param dict wlc: Dictionary defining the WLC creds
+    :param int batch_size: APs requested per <get>
+    :raises RPCError: if the WLC answers a request with an error
+    :raises TimeoutError: if the read runs past the deadline
+    """
+    deadline = time.monotonic() + int(wlc.get('deadline', WLC_POLL_DEADLINE))
+    keys = [element.text for element in iter_elements(
+        m.dispatch(et.fromstring(AP_GET_RPC.format(entries=AP_KEYS))).xml,
+        WTP_MAC)]
+    print(f"{len(keys)} APs on WLC {wlc['name']}")
+    for start in range(0, len(keys), batch_size):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"reading APs from WLC {wlc['name']} ran past "
+                               f"its deadline after {start} of {len(keys)}")
+        entries = ''.join(AP_ENTRY.replace('{wtp_mac}', escape(key))
+                          for key in keys[start:start + batch_size])
+        yield from iter_ap_records(m.dispatch(et.fromstring(
+            AP_GET_RPC.format(entries=entries))).xml, wlc)
+
+
+def get_ap_records(wlc, batch_size=AP_BATCH):
+    """Get the AP records of a WLC in batches, over one NETCONF session
+
+    See read_ap_records(); the session is opened for this one read.
+
+    :param dict wlc: Dictionary defining the WLC creds
+    :param int batch_size: APs requested per <get>
+    :raises: the connection or read error, after the records yielded so
+        far, which are then incomplete
+    """
+    with connect_wlc(wlc) as m:
+        yield from read_ap_records(m, wlc, batch_size)
+
+
+def poll_wlc(wlc):
+    """Read all APs of a WLC into an AP record set
+
+    Runs in a polling thread of main(), one per WLC.  A failed read
+    gives up on this WLC only; other WLCs may be polled in parallel.
+
+    :param dict wlc: Dictionary defining the WLC creds
+    :return: all APs of the WLC, or None if they could not all be read
+    :rtype: APRecordSet or None
+    """
+    try:
+        return APRecordSet(get_ap_records(wlc,
+                                          int(wlc.get('ap_batch', AP_BATCH))))
+    except errors.SSHError:
+        print(f"Unable to connect to device {wlc['name']}")
+    except Exception:
+        traceback.print_exc()
+        print(f"Reading APs from WLC {wlc['name']} failed")
+    return None
+
+
+def get_nb_session(netbox):
+    """Open a NetBox API session
+
+    :param dict netbox: Dictionary with NetBox environment parameters
+    :return: NetBox session handler
+    """
+    session = requests.Session()
+    session.verify = False
+    nb = pynetbox.api(f"{netbox['NETBOX_SCHEME']}://{netbox['NETBOX_HOST']}:{netbox['NETBOX_PORT']}",
+                      token=netbox["NETBOX_APIKEY"])
+    nb.http_session = session
+    return nb
+
+
+def get_nb_aps(nb, names):
+    """Get the NetBox AP devices with the given names
+
+    :param session nb: NetBox session handler
+    :param names: AP names
+    :return: NetBox device records by name
+    :rtype: dict
+    """
+    names = sorted(names)
+    devices = {}
+    for start in range(0, len(names), NB_FILTER_BATCH):
+        for device in nb.dcim.devices.filter(name=names[start:start + NB_FILTER_BATCH],
+                                             role='wireless-access-point'):
+            devices[device.name] = device
+    return devices
+
+
+def get_nb_locations(nb, names):
+    """Get the NetBox location ids of the given names
+
+    :param session nb: NetBox session handler
+    :param names: location (WLC site tag) names
+    :return: NetBox location ids by name
+    :rtype: dict
+    """
+    names = sorted(names)
+    locations = {}
+    for start in range(0, len(names), NB_FILTER_BATCH):
+        for location in nb.dcim.locations.filter(name=names[start:start + NB_FILTER_BATCH]):
+            locations[location.name] = location.id
+    return locations
+
+
+def update_aps_in_netbox(nb, records, model_maps, locations=None):
+    """Update NetBox APs from their current WLC records
+
+    Sets the device type, serial, location, site tag, WLC and status
+    'online' of each AP already in NetBox (bulk PATCH), and moves its
+    primary IP address when the AP's management IP changed.  An AP
+    without a primary IP (eg. its IP assignment failed when it was
+    created) gets one on its GigabitEthernet0 interface, as in
+    create_devices_in_netbox.
+
+    :param session nb: NetBox session handler
+    :param records: The current AP data records
+    :type records: List[APRecord]
+    :param dict model_maps: WLC model to NetBox device-type id
+    :param dict locations: NetBox location ids by name, if already known
+    """
+    nb_devices = get_nb_aps(nb, [record.ap_name for record in records])
+    if locations is None:
+        locations = get_nb_locations(nb, {record.site_tag_name
+                                          for record in records})
+    device_updates = []
+    ip_updates = []
+    missing_ips = {}
+    for record in records:
+        nbdevice = nb_devices.get(record.ap_name)
+        if nbdevice is None:
+            continue
+        update = {'id': nbdevice.id,
+                  'serial': record.wtp_serial_num,
+                  'status': 'online',
+                  'custom_fields': {'SiteTag': record.site_tag_name,
+                                    'WLC': record.wlc}}
+        if record.model in model_maps:
+            update['device_type'] = model_maps[record.model]
+        if record.site_tag_name in locations:
+            update['location'] = locations[record.site_tag_name]
+        device_updates.append(update)
+        address = f'{record.ip_addr}/32'
+        if nbdevice.primary_ip4 is None:
+            if record.ip_addr:
+                missing_ips[nbdevice.id] = (address, update)
+        elif str(nbdevice.primary_ip4) != address:
+            ip_updates.append({'id': nbdevice.primary_ip4.id,
+                               'address': address})
+    if missing_ips:
+        assign_ap_ips(nb, missing_ips)
+    if device_updates:
+        nb.dcim.devices.update(device_updates)
+    if ip_updates:
+        nb.ipam.ip_addresses.update(ip_updates)
+    print(f"Updated {len(device_updates)} AP(s) in NetBox")
+
+
+def assign_ap_ips(nb, missing_ips):
+    """Create management IPs for NetBox APs that have no primary IP
+
+    Each address is created on the AP's GigabitEthernet0 interface and
+    made primary through the AP's pending device update.
+
+    :param session nb: NetBox session handler
+    :param dict missing_ips: NetBox device id to (address, device update)
+    """
+    device_ids = sorted(missing_ips)
+    interfaces = {}
+    for start in range(0, len(device_ids), NB_FILTER_BATCH):
+        for interface in nb.dcim.interfaces.filter(
+                device_id=device_ids[start:start + NB_FILTER_BATCH],
+                name='GigabitEthernet0'):
+            interfaces[interface.id] = interface.device.id
+    new_ips = [dict(address=missing_ips[device_id][0],
+                    status='dhcp',
+                    role='vip',
+                    assigned_object_type='dcim.interface',
+                    assigned_object_id=interface_id)
+               for interface_id, device_id in interfaces.items()]
+    if not new_ips:
+        return
+    for ip in nb.ipam.ip_addresses.create(new_ips):
+        missing_ips[interfaces[ip.assigned_object_id]][1]['primary_ip4'] = ip.id
+    print(f"Assigned {len(new_ips)} missing AP management IP(s)")
+
+
+def retire_aps_in_netbox(nb, records, wlc):
+    """Mark NetBox APs no longer on their WLC as offline
+
+    APs that NetBox already has on another WLC (they moved) are left
+    alone.
+
+    :param session nb: NetBox session handler
+    :param records: The AP data records last seen for the APs
+    :type records: List[APRecord]
+    :param dict wlc: the WLC the APs left
+    """
+    nb_devices = {name: device for name, device
+                  in get_nb_aps(nb, [record.ap_name for record in records]).items()
+                  if device.custom_fields.get('WLC') in (None, wlc['name'])}
+    if nb_devices:
+        nb.dcim.devices.update([{'id': device.id, 'status': 'offline'}
+                                for device in nb_devices.values()])
+    print(f"Retired {len(nb_devices)} AP(s) in NetBox: {sorted(nb_devices)}")
+
+
+def sync_ap_changes(netbox, wlc, previous, current, lookups=None):
+    """Send only the changes between two polls of a WLC to NetBox
+
+    APs that appeared are created (or, when NetBox knows them already,
+    brought back online), APs whose data changed are updated and APs
+    that left the WLC are marked offline.  Unchanged APs cost nothing.
+
+    :param dict netbox: Dictionary with NetBox environment parameters
+    :param dict wlc: the WLC polled
+    :param APRecordSet previous: APs of the previous poll
+    :param APRecordSet current: APs of this poll
+    :param NBLookups lookups: NetBox session and lookups to reuse, as
+        kept by the long-running modes; a new one otherwise
+    """
+    appeared = [record for record in current
+                if record.ap_name not in previous.by_name]
+    changed = [record for record in current
+               if record.ap_name in previous.by_name
+               and record.values() != previous.by_name[record.ap_name].values()]
+    gone = [record for record in previous
+            if record.ap_name not in current.by_name]
+    print(f"WLC {wlc['name']}: {len(appeared)} new, {len(changed)} changed, "
+          f"{len(gone)} gone AP(s)")
+    if not (appeared or changed or gone):
+        return
+
+    if lookups is None:
+        lookups = NBLookups(netbox)
+    if appeared or changed:
+        delta = APRecordSet(appeared + changed)
+        lookups.prepare(delta)
+        if appeared:
+            do_device_work(lookups.nb, wlc, APRecordSet(appeared),
+                           lookups.model_mapping)
+        update_aps_in_netbox(lookups.nb, delta.records, lookups.model_mapping,
+                             lookups.locations)
+    if gone:
+        retire_aps_in_netbox(lookups.nb, gone, wlc)
+
+
+def run_daemon(config, wlcs, interval):
+    """Poll the WLCs continuously and keep NetBox in sync
+
+    Every 'interval' seconds all WLCs are polled concurrently over
+    their long-lived sessions (WLCSession).  The first successful poll
+    of a WLC is processed in full (do_netbox_work); every later one only
+    sends the changes since the previous poll (sync_ap_changes).  A WLC
+    that cannot be polled keeps its previous APs, so nothing is retired
+    because of an outage.  A failed NetBox sync is reported and leaves
+    the WLC's previous APs in place too, so its changes are sent again
+    on the next cycle.  NetBox work stays on this thread, as it may
+    still prompt for new site tags or device models.
+
+    :param dict config: A dictionary of environment settings from dotenv
+    :param list wlcs: WLCs to poll
+    :param int interval: seconds from the start of one poll cycle to
+        the start of the next
+    """
+    sessions = [WLCSession(wlc) for wlc in wlcs]
+    last_seen = {}
+    lookups = NBLookups(config)
+    workers = int(config.get('WLC_POLL_WORKERS', WLC_POLL_WORKERS))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                started = time.monotonic()
+                polls = {pool.submit(session.poll): session
+                         for session in sessions}
+                for poll in as_completed(polls):
+                    wlc = polls[poll].wlc
+                    aps = poll.result()
+                    if aps is None:
+                        continue
+                    try:
+                        if wlc['name'] in last_seen:
+                            sync_ap_changes(config, wlc,
+                                            last_seen[wlc['name']], aps,
+                                            lookups)
+                        elif aps:
+                            do_netbox_work(config, wlc, aps)
+                    except Exception:
+                        traceback.print_exc()
+                        print(f"NetBox sync of WLC {wlc['name']} failed; "
+                              f"retrying next cycle")
+                        # What NetBox held may have changed under the cache
+                        lookups = NBLookups(config)
+                        continue
+                    last_seen[wlc['name']] = aps
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+    finally:
+        for session in sessions:
+            session.close()
+
+
+def establish_ap_subscription(m, mode, interval):
+    """Set up a yang-push subscription to the WLC capwap-data
+
+    :param m: ncclient manager (open session to the WLC)
+    :param str mode: 'on-change' or 'periodic'
+    :param int interval: seconds between periodic updates
+    :raises RuntimeError: if the WLC does not accept the subscription
+    """
+    if mode == 'on-change':
+        trigger = '<yp:dampening-period>0</yp:dampening-period>'
+    else:
+        trigger = f'<yp:period>{interval * 100}</yp:period>'
+    reply = dispatch_rpc(m, AP_SUBSCRIBE_RPC.format(trigger=trigger))
+    result = et.fromstring(reply.encode('utf-8')).xpath(
+        "//*[local-name()='subscription-result']/text()")
+    if not result or not result[0].endswith('ok'):
+        raise RuntimeError(f'subscription not accepted: {reply}')
+
+
+def apply_ap_notification(notification, wlc, aps):
+    """Apply one yang-push notification to a WLC's AP record set
+
+    Works on the notification XML only, so it does not depend on a live
+    NETCONF session.  A periodic update (push-update) carries all
+    capwap-data and replaces the set.  An on-change update
+    (push-change-update) carries yang-patch edits: a create, merge or
+    replace of a capwap-data entry (or of some of its leaves) adds or
+    updates that AP, a delete or remove of the entry drops it.  Any
+    other notification leaves the set as it is.
+
+    :param xmlstr notification: notification XML
+    :param dict wlc: the WLC the notification came from
+    :param APRecordSet aps: the WLC's APs before the notification
+    :return: the WLC's APs after the notification
+    :rtype: APRecordSet
+    """
+    root = et.fromstring(notification.encode('utf-8'))
+    kinds = {et.QName(element).localname for element in root}
+    if 'push-update' in kinds:
+        return APRecordSet(iter_ap_records(notification, wlc))
+    if 'push-change-update' not in kinds:
+        return aps
+
+    by_mac = {record.wtp_mac: record for record in aps}
+    for edit in root.iter(YANG_PATCH_EDIT):
+        operation = edit.findtext(YANG_PATCH_OPERATION, '').strip()
+        target = edit.findtext(YANG_PATCH_TARGET, '')
+        value = edit.find(YANG_PATCH_VALUE)
+        fields = {}
+        if value is not None:
+            for element in value.iter():
+                field = AP_FIELDS.get(element.tag)
+                if field is not None and field not in fields:
+                    fields[field] = element.text or ''
+        key = WTP_MAC_KEY.search(target)
+        wtp_mac = fields.get('wtp_mac') or (key.group(1) if key else None)
+        if wtp_mac is None:
+            continue
+        if operation in ('delete', 'remove'):
+            # Only the removal of the whole entry means the AP left
+            if key and not target[key.end():].strip('/'):
+                by_mac.pop(wtp_mac, None)
+            continue
+        known = by_mac.get(wtp_mac)
+        if known is not None:
+            fields = {field: fields.get(field, getattr(known, field))
+                      for field in AP_FIELDS.values()}
+        fields['wtp_mac'] = wtp_mac
+        if fields.get('ap_name'):
+            by_mac[wtp_mac] = APRecord(wlc=wlc['name'], **fields)
+    return APRecordSet(by_mac.values())
+
+
+def subscribe_wlc(wlc, mode, interval, events):
+    """Keep a yang-push subscription to a WLC, queueing its notifications
+
+    Runs in its own thread per WLC.  Each notification is put on
+    'events' as (wlc, notification XML).  After the subscription is
+    (re)established (wlc, None) is queued first, asking for a full poll,
+    so no change made while unsubscribed is missed.  Lost sessions are
+    re-established with the same backoff as daemon mode.
+
+    :param dict wlc: Dictionary defining the WLC creds
+    :param str mode: 'on-change' or 'periodic'
+    :param int interval: seconds between periodic updates
+    :param queue.Queue events: where notifications are put
+    """
+    backoff = 0
+    while True:
+        try:
+            with connect_wlc(wlc) as m:
+                establish_ap_subscription(m, mode, interval)
+                print(f"Subscribed ({mode}) to APs of WLC {wlc['name']}")
+                backoff = 0
+                events.put((wlc, None))
+                while m.connected:
+                    notification = m.take_notification(block=True,
+                                                       timeout=interval)
+                    if notification is not None:
+                        events.put((wlc, notification.notification_xml))
+        except Exception as e:
+            print(f"Subscription to WLC {wlc['name']} failed ({e!r})")
+        backoff = min(max(backoff * 2, RECONNECT_MIN), RECONNECT_MAX)
+        print(f"Re-subscribing to WLC {wlc['name']} in {backoff} seconds")
+        time.sleep(backoff)
+
+
+def run_subscriptions(config, wlcs, mode, interval):
+    """Keep NetBox in sync with the WLCs from yang-push notifications
+
+    One thread per WLC holds its subscription (subscribe_wlc); this
+    thread applies the notifications in arrival order, each sending only
+    the resulting AP change(s) to NetBox (sync_ap_changes), with the
+    NetBox lookups cached across events (NBLookups).  A full poll of a
+    WLC, asked for whenever its subscription is (re)established, is
+    imported in full the first time and synced as a delta after.
+
+    A notification that cannot be parsed is reported and skipped.  A
+    failed NetBox sync is reported and the WLC's last synced APs are
+    kept, so its changes go out again with the next event.
+
+    :param dict config: A dictionary of environment settings from dotenv
+    :param list wlcs: WLCs to subscribe to
+    :param str mode: 'on-change' or 'periodic'
+    :param int interval: seconds between periodic updates
+    """
+    events = queue.Queue()
+    for wlc in wlcs:
+        threading.Thread(target=subscribe_wlc, args=(wlc, mode, interval, events),
+                         name=f"subscribe-{wlc['name']}", daemon=True).start()
+    # APs of each WLC as of its latest event, and as last sent to NetBox
+    wlc_aps = {}
+    last_seen = {}
+    lookups = NBLookups(config)
+    while True:
+        wlc, notification = events.get()
+        name = wlc['name']
+        if notification is None:
+            session = WLCSession(wlc)
+            current = session.poll()
+            session.close()
+            if current is None:
+                continue
+        else:
+            try:
+                current = apply_ap_notification(
+                    notification, wlc, wlc_aps.get(name, APRecordSet([])))
+            except et.XMLSyntaxError as e:
+                print(f"Skipped malformed notification from WLC {name}: {e}")
+                continue
+        wlc_aps[name] = current
+        try:
+            if name in last_seen:
+                sync_ap_changes(config, wlc, last_seen[name], current, lookups)
+            elif current:
+                do_netbox_work(config, wlc, current)
+        except Exception:
+            traceback.print_exc()
+            print(f"NetBox sync of WLC {name} failed; retrying with its "
+                  f"next event")
+            lookups = NBLookups(config)
+            continue
+        last_seen[name] = current
+
+
+def replay_notifications(files, wlc_name='replay'):
+    """Apply yang-push notification files to an empty AP set, offline
+
+    A stand-in for a WLC subscription: no WLC or NetBox is contacted.
+    The AP changes each notification would send to NetBox are printed,
+    eg. for examples/notifications/push-update.xml followed by
+    push-change-update.xml.
+
+    :param list files: notification XML files, applied in order
+    :param str wlc_name: WLC name the APs are tagged with
+    :return: the APs after the last notification
+    :rtype: APRecordSet
+    """
+    wlc = {'name': wlc_name}
+    aps = APRecordSet([])
+    for file in files:
+        with open(file, 'r') as xmlfile:
+            current = apply_ap_notification(xmlfile.read(), wlc, aps)
+        appeared = sorted(set(current.by_name) - set(aps.by_name))
+        changed = sorted(name for name in set(current.by_name) & set(aps.by_name)
+                         if current.by_name[name].values()
+                         != aps.by_name[name].values())
+        gone = sorted(set(aps.by_name) - set(current.by_name))
+        print(f"{file}: new {appeared}, changed {changed}, gone {gone}")
+        aps = current
+    for record in aps:
+        print(f"  {record.ap_name} {record.model} {record.ip_addr} "
+              f"{record.site_tag_name}")
+    return aps
 
 
 def get_wlcs(config):
@@ -727,7 +1396,7 @@ def get_wlcs(config):
     return new_wlc_list
 
 
-'''def get_runtime_args():
+def get_runtime_args():
     """Get user inputs for runtime options
 
     Uses ArgumentParser to read user CLI inputs and arguments.
@@ -735,30 +1404,45 @@ def get_wlcs(config):
 
     :returns: args as user arguments
     """
-    parser = argparse.ArgumentParser(description='Execute config change monitoring for device via NETCONF.')
-    parser.add_argument('-d', '--device', type=str, required=True,
-                        help='The device name or IP address to monitor')
-    parser.add_argument('-u', '--username', type=str, required=True,
-                        help="The device's NETCONF user name for access")
-    parser.add_argument('-p', '--password', type=str, required=True,
-                        help="The device's NETCONF user's password for access")
+    parser = ArgumentParser(description='Import Cisco WLC APs into NetBox.')
+    parser.add_argument('-d', '--daemon', action='store_true',
+                        help='Keep running: poll the WLCs every interval '
+                        'and send only the changes to NetBox')
+    parser.add_argument('-i', '--interval', type=int, default=60,
+                        help='Seconds between polls in daemon mode, or '
+                        'between periodic subscription updates (default 60)')
+    parser.add_argument('-s', '--subscribe', choices=('on-change', 'periodic'),
+                        help='Keep running on a yang-push subscription to '
+                        'the WLC AP data instead of polling')
+    parser.add_argument('-n', '--notification', nargs='+', metavar='FILE',
+                        help='Apply yang-push notification XML file(s), eg. '
+                        'examples/notifications/*.xml, and print the AP '
+                        'changes, without contacting any WLC or NetBox')
 
     args = parser.parse_args()
+    if args.interval < 1:
+        parser.error('--interval must be at least 1 second')
 
     return args
-'''
+
 
 ####### Module Function definitions above
 ###############################################################################
 ####### Main function definition below
 
-def main():
+def main(args):
     """Do the main work of collecting AP data, converting and importing
     
     Call the high-level functions of collecting the AP data from the
-    WLC(s), then converting it, then importing it into NetBox
+    WLC(s), then converting it, then importing it into NetBox; once, or
+    continuously in daemon mode
+
+    :param args: command-line arguments (see get_runtime_args)
     """
     urllib3.disable_warnings()
+    if args.notification:
+        replay_notifications(args.notification)
+        return
 
     now = datetime.now() # current date and time
     date_time = now.strftime("%Y%m%d-%H%M%S")
@@ -772,15 +1456,34 @@ def main():
             **os.environ,  # override loaded values with environment variables
         }
     wlcs = get_wlcs(config)
-    for wlc in wlcs:
-        apdata = get_aps_from_wlc(wlc)
-        do_netbox_work(config, wlc, apdata)
+    if args.subscribe:
+        run_subscriptions(config, wlcs, args.subscribe, args.interval)
+        return
+    if args.daemon:
+        run_daemon(config, wlcs, args.interval)
+        return
+    workers = int(config.get('WLC_POLL_WORKERS', WLC_POLL_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        polls = {pool.submit(poll_wlc, wlc): wlc for wlc in wlcs}
+        # WLCs are processed as their polls complete; the NetBox work
+        # stays on this thread, as it may prompt the user, and overlaps
+        # with the polls still running
+        for poll in as_completed(polls):
+            wlc = polls[poll]
+            aps = poll.result()
+            if aps is None:
+                print(f"Poll of WLC {wlc['name']} failed, skipping")
+                continue
+            if not aps:
+                print(f"No APs read from WLC {wlc['name']}, skipping")
+                continue
+            do_netbox_work(config, wlc, aps)
 
 
 if __name__ == '__main__':
     try:
-        #args = get_runtime_args()
-        main()
+        args = get_runtime_args()
+        main(args)
     except KeyboardInterrupt:
         print(f'\nUser stopped execution...Exiting.')
         exit()
\ No newline at end of file
@@ -4,16 +4,30 @@
     package pynetbox
 
     Args:
-    usage: import_csv2nb.py [-h] [-f import.csv] -a/-i
+    usage: import_csv2nb.py [-h] [-f import.csv] [-c rows] [-j jobs]
+                            [--resume] [--full] [--infra] -a/-i
 
     options:
     -h, --help            show this help message and exit
-    -d, --file filename   CSV file to use for import
+    -d, --file filename   CSV or XLSX file, directory or glob of files
+                          to use for import
+    -c, --chunksize rows  Rows read and imported per chunk (default 5000)
+    -j, --jobs jobs       Processes parsing XLSX workbooks in parallel
+                          (default CPU count)
+    --resume              Finish the devices an interrupted import left
+                          half-done, from the journal
+                          import_csv2nb_journal.jsonl
+    --full                Update every device imported before, not only
+                          those whose row changed since
+    --infra               Create missing infra.yaml records (tenant-groups,
+                          tenants, regions, site-groups, sites and
+                          manufacturers) before importing
     -i, --idf             Identifies IDF switches are being imported
     -a, --access          Identified access switches are being imported
     
     Inputs/Reference files:
-        (filename).csv    Filename containing devices to import
+        (filename).csv    Filename containing devices to import; XLSX
+                          workbooks (every sheet) are read directly
                           Examples are supplied as import-example.xslt
                           and import-example.csv
 
@@ -21,6 +35,10 @@
             server IP/hostname, access credentials, etc
             (See examples/*.yaml for formatting guidance)
  
+        import_csv2nb_state.json - content hash and NetBox ids of each
+            device imported; rows unchanged since are skipped and
+            changed rows are updated in place (written by the script)
+ 
     Returns:
         Output to console while running shows progress of import. 
 
@@ -33,10 +51,19 @@
         
     Version History:
     1   2024-0522   Initial development
+    2   2026-1017   Chunked streaming CSV ingestion
+                    Batch site/location/role/tenant resolution
+                    Shared SQLite device-type mapping store
+                    Bulk site and location creation
+                    Dependency-ordered infra.yaml sync (--infra)
+                    Vectorized validation/normalization of inventory
+                    Multi-file CSV/XLSX ingestion, parallel parsing
+                    Write-ahead import journal, --resume
+                    Content-hash change detection, updates by id
 """
 
 # Credits:
-__version__ = '1'
+__version__ = '2'
 __author__ = 'Jason Davis - jadavis@cisco.com'
 __license__ = "'Apache License, Version 2.0 - ' \
     'http://www.apache.org/licenses/LICENSE-2.0'"
@@ -48,6 +75,8 @@ import sys
 import os
 from common.getEnv import getparam
 from callnetboxapi import getnetbox, postnetbox
+import hashlib
+import ipaddress
 import json
 import pynetbox
 from pprint import pprint
@@ -58,6 +87,10 @@ import numpy as np
 import argparse
 from slugify import slugify
 from map_dt2netbox import map2nbdt
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import ExitStack
+import glob
+import yaml
 
 
 def get_nb_env():
@@ -78,162 +111,303 @@ def get_nb_env():
     # Read project environment parameters file
 
 
-def process_tg(nb):
-    # Process Tenant-Groups
-    tg_items = getparam('Tenant-Groups', envfile='infra.yaml')
-    #print(tg_items)
-    
-    tgnames = [tg['name'] for tg in tg_items]
-    #print(tgnames)
-    nb_tgnames = [tg.name for tg in list(nb.tenancy.tenant_groups.all())]
-    #print(nb_tgnames)
-    missing_tg = list(set(tgnames).difference(nb_tgnames))
-    #print(missing_tg)
-    if not missing_tg:
-        # No missing tenant-groups to configure
-        print("No missing Tenant-Groups")
-    else:
-        # We have missing tenant-groups to add to NetBox
-        nb_adds = [tg for tg in tg_items if tg["name"] in missing_tg]
-        print(f"Missing Tenant-Groups: {nb_adds}")
-        new_tgs = nb.tenancy.tenant_groups.create(nb_adds)
-        #print(new_tgs)
+# Infrastructure object types read from infra.yaml: the NetBox endpoint
+# (app, endpoint) each is created in, and the types its entries refer to
+# and so must exist first
+INFRA_TYPES = {
+    'Tenant-Groups': {'endpoint': ('tenancy', 'tenant_groups'),
+                      'depends': []},
+    'Tenants': {'endpoint': ('tenancy', 'tenants'),
+                'depends': ['Tenant-Groups']},
+    'Regions': {'endpoint': ('dcim', 'regions'),
+                'depends': []},
+    'Site-Groups': {'endpoint': ('dcim', 'site_groups'),
+                    'depends': []},
+    'Sites': {'endpoint': ('dcim', 'sites'),
+              'depends': ['Regions', 'Site-Groups', 'Tenants']},
+    'Manufacturers': {'endpoint': ('dcim', 'manufacturers'),
+                      'depends': []},
+}
 
 
-def process_tenants(nb):
-    # Process Tenants
-    tenant_items = getparam('Tenants', envfile='infra.yaml')
-    #print(tenant_items)
-    
-    tenantnames = [tenant['name'] for tenant in tenant_items]
-    #print(tenantnames)
-    nb_tenantnames = [tenant.name for tenant in list(nb.tenancy.tenants.all())]
-    #print(nb_tenantnames)
-    missing_tenants = list(set(tenantnames).difference(nb_tenantnames))
-    #print(missing_tenants)
-    if not missing_tenants:
-        # No missing tenants to configure
-        print("No missing Tenants")
-    else:
-        # We have missing tenant-groups to add to NetBox
-        nb_adds = [tenant for tenant in tenant_items if tenant["name"] in missing_tenants]
-        print(f"Missing Tenant(s): {nb_adds}")
-        new_tgs = nb.tenancy.tenants.create(nb_adds)
-        #print(new_tgs)
-        for i in new_tgs:
-            print(f"Created tenant \"{i.name}\" with following results -")
-            pprint(dict(i), indent=4)
-
-
-def process_regions(nb):
-    # Process Regions
-    region_items = getparam('Regions', envfile='infra.yaml')
-    #print(region_items)
-    
-    regionnames = [region['name'] for region in region_items]
-    #print(regionnames)
-    nb_regionnames = [region.name for region in list(nb.dcim.regions.all())]
-    #print(nb_regionnames)
-    missing_regions = list(set(regionnames).difference(nb_regionnames))
-    #print(missing_regions)
-    if not missing_regions:
-        # No missing regions to configure
-        print("No missing Regions")
-    else:
-        # We have missing regions to add to NetBox
-        nb_adds = [region for region in region_items if region["name"] in missing_regions]
-        print(f"Missing Tenant(s): {nb_adds}")
-        new_tgs = nb.dcim.regions.create(nb_adds)
-        #print(new_tgs)
-        for i in new_tgs:
-            print(f"Created region \"{i.name}\" with following results -")
-            pprint(dict(i), indent=4)
-
-
-def process_sitegroups(nb):
-    # Process Site Groups
-    sitegroup_items = getparam('Site-Groups', envfile='infra.yaml')
-    #print(sitegroup_items)
-    
-    sitegroupnames = [sitegroup['name'] for sitegroup in sitegroup_items]
-    #print(sitegroupnames)
-    nb_sitegroupnames = [sitegroup.name for sitegroup in list(nb.dcim.site_groups.all())]
-    #print(nb_sitegroupnames)
-    missing_sitegroups = list(set(sitegroupnames).difference(nb_sitegroupnames))
-    #print(missing_sitegroups)
-    if not missing_sitegroups:
-        # No missing sitegroups to configure
-        print("No missing Site-Groups")
-    else:
-        # We have missing sitegroups to add to NetBox
-        nb_adds = [sitegroup for sitegroup in sitegroup_items if sitegroup["name"] in missing_sitegroups]
-        print(f"Missing Site-Group(s): {nb_adds}")
-        new_tgs = nb.dcim.site_groups.create(nb_adds)
-        #print(new_tgs)
-        for i in new_tgs:
-            print(f"Created Site-Group \"{i.name}\" with following results -")
-            pprint(dict(i), indent=4)
-
-
-def process_sites(nb):
-    # Process Sites
-    site_items = getparam('Sites', envfile='infra.yaml')
-    #print(site_items)
-    
-    sitenames = [site['name'] for site in site_items]
-    #print(sitenames)
-    nb_sitenames = [site.name for site in list(nb.dcim.sites.all())]
-    #print(nb_sitenames)
-    missing_sites = list(set(sitenames).difference(nb_sitenames))
-    #print(missing_sites)
-    if not missing_sites:
-        # No missing sites to configure
-        print("No missing Sites")
-    else:
-        # We have missing sites to add to NetBox
-        nb_adds = [site for site in site_items if site["name"] in missing_sites]
-        print(f"Missing Site(s): {nb_adds}")
-        new_tgs = nb.dcim.sites.create(nb_adds)
-        #print(new_tgs)
-        for i in new_tgs:
-            print(f"Created Site \"{i.name}\" with following results -")
-            pprint(dict(i), indent=4)
-
-
-def process_manufacturers(nb):
-    """Read infrastructure YAML file (infra.yaml) and import manufacturers"""
-    manufacturer_items = getparam('Manufacturers', envfile='infra.yaml')
-    #print(site_items)
-    
-    manufacturernames = [manufacturer['name'] for manufacturer in manufacturer_items]
-    #print(sitenames)
-    nb_manufacturernames = [manufacturer.name for manufacturer in list(nb.dcim.manufacturers.all())]
-    #print(nb_sitenames)
-    missing_manufacturers = list(set(manufacturernames).difference(nb_manufacturernames))
-    #print(missing_sites)
-    if not missing_manufacturers:
-        # No missing sites to configure
-        print("No missing Manufacturers")
+def load_infra(envfile='infra.yaml'):
+    # Read and parse the infrastructure YAML file once
+    if not os.path.isfile(envfile):
+        sys.exit(f'Infrastructure YAML file {envfile} NOT found.  Exiting.')
+    with open(envfile, 'r') as ymlfile:
+        return yaml.safe_load(ymlfile) or {}
+
+
+def infra_levels(infra_types):
+    # Group infrastructure types into levels; every type only depends on
+    # types in earlier levels, so the types of one level can run together
+    levels = []
+    done = set()
+    remaining = dict(infra_types)
+    while remaining:
+        level = [name for name, spec in remaining.items()
+                 if set(spec['depends']) <= done]
+        if not level:
+            sys.exit(f'Circular infrastructure dependencies: {list(remaining)}')
+        levels.append(level)
+        done.update(level)
+        for name in level:
+            del remaining[name]
+    return levels
+
+
+def process_infra_type(nb, name, items):
+    # Create the entries of one infrastructure type missing from NetBox
+    # Fetch all existing names, diff, then bulk create the missing ones
+    app, endpoint_name = INFRA_TYPES[name]['endpoint']
+    endpoint = getattr(getattr(nb, app), endpoint_name)
+    nb_names = {item.name for item in endpoint.all()}
+    nb_adds = [item for item in items if item['name'] not in nb_names]
+    if not nb_adds:
+        print(f"No missing {name}")
+        return
+    print(f"Missing {name}: {[item['name'] for item in nb_adds]}")
+    for result in bulk_create(endpoint, nb_adds, name):
+        print(f"Created {name} \"{result.name}\"")
+
+
+def process_infra(nb, infra):
+    """Create missing infrastructure records from infra.yaml
+
+    Works level by level through the INFRA_TYPES dependency graph
+    (tenant-groups before tenants, regions/site-groups/tenants before
+    sites); the independent types within a level are processed
+    concurrently.
+
+    :param nb: (class of pynetbox.core.api.Api) Netbox session
+    :param infra: (dict) parsed infra.yaml
+    """
+    for level in infra_levels(INFRA_TYPES):
+        with ThreadPoolExecutor(max_workers=len(level)) as pool:
+            futures = [pool.submit(process_infra_type, nb, name, infra[name])
+                       for name in level if infra.get(name)]
+            for future in futures:
+                future.result()
+
+
+# Declared CSV column types; every inventory column is text, so pandas
+# does not have to infer types (eg. numeric-looking names or serials)
+COLUMN_DTYPES = {'Name': str, 'ManagementIP': str, 'DeviceType': str,
+                 'SerialNumber': str, 'Custom_SWVer': str,
+                 'Custom_Function': str, 'Site': str, 'Location': str,
+                 'AreaRoom': str, 'Comments': str}
+
+
+def canonical_ip(value):
+    """Canonical 'address/prefixlen' form of an inventory ManagementIP
+
+    Leading zeros are dropped from each octet (eg. 010.001.002.003 is
+    10.1.2.3), '/32' is assumed when no prefix length or netmask is
+    given and a netmask is turned into its prefix length, so every
+    spelling of an address compares equal.
+
+    :param value: ManagementIP cell, may be NaN
+    :returns: canonical string, NaN for an empty cell or None when the
+        value is not a valid IPv4 address
+    """
+    if pd.isna(value):
+        return value
+    address, _, length = value.strip().partition('/')
+    octets = address.split('.')
+    if not all(octet.isdigit() for octet in octets):
+        return None
+    try:
+        return str(ipaddress.IPv4Interface(
+            f"{'.'.join(str(int(octet)) for octet in octets)}/{length or 32}"))
+    except ValueError:
+        return None
+
+
+# Columns that must be unique within an inventory
+UNIQUE_COLUMNS = ('Name', 'ManagementIP', 'SerialNumber')
+
+
+def normalize_inventory(inventory, seen):
+    """Validate and normalize a chunk of inventory before any API call
+
+    Vectorized (column-wise) pandas pass over the chunk:
+      - rows without a Name are dropped; Names are stripped, lower-case
+      - ManagementIP is put in canonical form (see canonical_ip); invalid
+        addresses are reported and cleared
+      - SerialNumber defaults to '' and AreaRoom to 'TBD'
+      - rows repeating a Name, ManagementIP address or SerialNumber of an
+        earlier row of the chunk, or of a row kept from an earlier chunk,
+        are reported and dropped
+
+    :param inventory: DataFrame chunk as read from the inventory file
+    :param seen: dictionary of column name to set of values kept so far
+        in this file, updated in place
+    :returns: normalized DataFrame
+    """
+    inventory = inventory.reindex(columns=list(dict.fromkeys(
+        [*inventory.columns, *COLUMN_DTYPES])))
+    # Columns missing from (or blank throughout) a file come back as
+    # floats; hold them as text so the .str operations below apply
+    inventory = inventory.astype({column: object for column in COLUMN_DTYPES
+                                  if inventory[column].dtype == float})
+    inventory = inventory.dropna(subset=['Name']).copy()
+    inventory['Name'] = inventory['Name'].str.strip().str.lower()
+
+    ip = inventory['ManagementIP'].map(canonical_ip)
+    valid = ip.notna() | inventory['ManagementIP'].isna()
+    for name, address in zip(inventory['Name'][~valid],
+                             inventory['ManagementIP'][~valid]):
+        print(f"INVALID ManagementIP '{address}' for '{name}' - cleared")
+    # Held as text even when every address in the chunk is blank
+    inventory['ManagementIP'] = ip.where(valid).astype(object)
+
+    inventory['SerialNumber'] = inventory['SerialNumber'].str.strip()
+    inventory['SerialNumber'] = inventory['SerialNumber'].where(
+        inventory['SerialNumber'] != '')
+
+    # Uniqueness is checked on the validated values, per column: a value
+    # repeats when it follows the values kept from earlier chunks or an
+    # earlier row of this chunk.  Only the rows kept add their Name,
+    # address and SerialNumber to 'seen'; the same address with another
+    # prefix length is still a duplicate
+    keys = inventory[list(UNIQUE_COLUMNS)].astype(object)
+    keys['ManagementIP'] = keys['ManagementIP'].str.split('/').str[0]
+    duplicate = pd.Series(False, index=inventory.index)
+    for column in UNIQUE_COLUMNS:
+        values = keys[column]
+        previous = pd.Series(list(seen.setdefault(column, set())),
+                             dtype=object)
+        repeated = pd.concat([previous, values]).duplicated(keep='first')
+        repeated = values.notna() & repeated.iloc[len(previous):].to_numpy()
+        for name, value in zip(inventory['Name'][repeated], values[repeated]):
+            print(f"DUPLICATE {column} '{value}' on '{name}' - row skipped")
+        duplicate |= repeated
+    inventory = inventory[~duplicate]
+    for column in UNIQUE_COLUMNS:
+        seen[column].update(keys[column][~duplicate].dropna())
+
+    inventory['SerialNumber'] = inventory['SerialNumber'].fillna('')
+    inventory['AreaRoom'] = inventory['AreaRoom'].fillna('TBD')
+    return inventory
+
+
+# Inventory file types accepted by open_inventory
+CSV_SUFFIXES = ('.csv',)
+XLSX_SUFFIXES = ('.xlsx', '.xlsm')
+
+
+def inventory_files(spec):
+    """Expand an inventory file spec to the list of files to import
+
+    :param spec: a CSV/XLSX file, a directory holding them, or a glob
+        pattern (eg. 'buildings/*.xlsx')
+    :returns: sorted list of file paths
+    """
+    if os.path.isdir(spec):
+        files = [os.path.join(spec, name) for name in os.listdir(spec)]
     else:
-        # We have missing manufacturers to add to NetBox
-        nb_adds = [manufacturer for manufacturer in manufacturer_items if manufacturer["name"] in missing_manufacturers]
-        print(f"Missing Manufacturer(s): {nb_adds}")
-        new_manufacturers = nb.dcim.manufacturers.create(nb_adds)
-        #print(new_tgs)
-        for i in new_manufacturers:
-            print(f"Created Manufacturer \"{i.name}\" with following results -")
-            pprint(dict(i), indent=4)
-
-
-def opencsv(file):
-    colnames=['Name', 'ManagementIP', 'DeviceType', 'SerialNumber', 
-              'Custom_SWVer', 'Custom_Function', 'Site', 'Location', 
-              'AreaRoom', 'Comments'] 
-    #inventory = pd.read_csv(file, names=colnames, header=0, comment='#')
-    inventory = pd.read_csv(file, header=0, comment='#', quoting=2)
-    inventory_dict = inventory.to_dict(orient='records')
-    #print(inventory_dict)
-    return inventory_dict
+        files = glob.glob(spec)
+    files = sorted(file for file in files
+                   if file.lower().endswith(CSV_SUFFIXES + XLSX_SUFFIXES)
+                   and not os.path.basename(file).startswith('~$'))
+    if not files:
+        sys.exit(f'No CSV or XLSX inventory files found for {spec}.  Exiting.')
+    return files
+
+
+def xlsx_text(value):
+    # Text of an XLSX cell as it reads from the CSV export: Excel stores
+    # every number as a float, so a whole number (eg. a serial or asset
+    # tag 1234) is written without the '.0' str() would add
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def read_xlsx(file):
+    """Read every worksheet of an XLSX inventory workbook
+
+    Runs in a worker process (see open_inventory).  The workbook is
+    opened read-only so rows are streamed rather than loading the whole
+    document tree.  The first row of each sheet holds the column names,
+    as in the CSV export of the template; rows whose first cell starts
+    with '#' are comments and skipped, like in the CSV files.
+
+    :param file: XLSX file name
+    :returns: DataFrame of the rows of all sheets, every value as text
+    """
+    # Only needed for workbooks, so imported here rather than globally
+    import openpyxl
+
+    rows = []
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            lines = sheet.iter_rows(values_only=True)
+            header = next(lines, None)
+            if header is None:
+                continue
+            columns = [(pos, name) for pos, name in enumerate(header)
+                       if isinstance(name, str) and name.strip()]
+            for line in lines:
+                if not line or str(line[0]).startswith('#'):
+                    continue
+                row = {name.strip(): xlsx_text(line[pos])
+                       for pos, name in columns
+                       if pos < len(line) and line[pos] is not None}
+                if row:
+                    rows.append(row)
+    finally:
+        workbook.close()
+    return pd.DataFrame(rows, dtype=object)
+
+
+def open_inventory(spec, chunksize=5000, jobs=None):
+    """Stream the inventory files in fixed-size chunks
+
+    Yields one list of row dictionaries per chunk of 'chunksize' rows
+    across all the files of 'spec' (see inventory_files), in file name
+    order.  CSV files are streamed chunk by chunk; XLSX workbooks are
+    parsed in parallel in a pool of 'jobs' processes while the earlier
+    files are imported, at most 'jobs' workbooks ahead of the file being
+    imported, so parsed workbooks do not pile up in memory.  Each chunk is validated and normalized first
+    (see normalize_inventory) with one set of seen values, so a device
+    listed in two files is only imported once.
+    """
+    files = inventory_files(spec)
+    workbooks = [file for file in files
+                 if file.lower().endswith(XLSX_SUFFIXES)]
+    seen = {}
+    with ExitStack() as stack:
+        parsed = {}
+        queued = iter(workbooks)
+
+        def parse_next():
+            # Start parsing the next workbook not yet submitted, if any
+            file = next(queued, None)
+            if file is not None:
+                parsed[file] = pool.submit(read_xlsx, file)
+
+        if workbooks:
+            workers = min(jobs or os.cpu_count() or 1, len(workbooks))
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            for _ in range(workers):
+                parse_next()
+        for file in files:
+            print(f'Reading inventory file {file}')
+            if file in parsed:
+                inventory = parsed.pop(file).result()
+                parse_next()
+                reader = (inventory.iloc[start:start + chunksize]
+                          for start in range(0, len(inventory), chunksize))
+            else:
+                #inventory = pd.read_csv(file, names=colnames, header=0, comment='#')
+                reader = pd.read_csv(file, header=0, comment='#', quoting=2,
+                                     dtype=COLUMN_DTYPES, chunksize=chunksize)
+            for chunk in reader:
+                chunk = normalize_inventory(chunk, seen)
+                if not chunk.empty:
+                    yield chunk.to_dict(orient='records')
 
 
 def get_sites(inventory_dict):
@@ -260,6 +434,57 @@ def get_locations(inventory_dict):
     return unique_locations
 
 
+# Records per bulk create request
+BULK_BATCH = 200
+# Names per name-filtered list request, keeps URLs short
+FILTER_BATCH = 100
+
+
+def filter_by_names(endpoint, names, **filters):
+    # Name-filtered list call(s) against a NetBox endpoint, batched
+    names = sorted(names)
+    for i in range(0, len(names), FILTER_BATCH):
+        yield from endpoint.filter(name=names[i:i + FILTER_BATCH], **filters)
+
+
+def bulk_create(endpoint, records, label):
+    # Create records with bulk POSTs of up to BULK_BATCH records
+    # NetBox rejects a whole batch if any record in it is bad, so a
+    # failed batch is split in halves until the offending record(s) are
+    # isolated and reported; all other records are still created
+    created = []
+    for i in range(0, len(records), BULK_BATCH):
+        created += _bulk_batch(endpoint.create, records[i:i + BULK_BATCH],
+                               label)
+    return created
+
+
+def bulk_update(endpoint, records, label):
+    # Update records (dicts with 'id') with bulk PATCHes, as bulk_create
+    updated = []
+    for i in range(0, len(records), BULK_BATCH):
+        updated += _bulk_batch(endpoint.update, records[i:i + BULK_BATCH],
+                               label)
+    return updated
+
+
+def _bulk_batch(call, records, label):
+    if not records:
+        return []
+    try:
+        return list(call(records))
+    except pynetbox.core.query.RequestError as e:
+        if len(records) == 1:
+            record = records[0]
+            print(f"FAILED {label} "
+                  f"'{record.get('name', record.get('address', record.get('id')))}'"
+                  f": {e.error}")
+            return []
+        middle = len(records) // 2
+        return (_bulk_batch(call, records[:middle], label)
+                + _bulk_batch(call, records[middle:], label))
+
+
 def build_sites(nb, sites, default_items):
     # Builds sites in Netbox via pynetbox library
     # nb = netbox session
@@ -268,30 +493,33 @@ def build_sites(nb, sites, default_items):
     #   shows we need to provide name and slug (url-friendly name)
     #   I will also assume status, region, tenant, timezone
     #       *change to suit your situation*
+    # Existing sites are found with one snapshot; only missing sites are
+    # created, with bulk requests
     status = "planned" # Provide as string to create method
 
+    existing = {site.name for site in filter_by_names(nb.dcim.sites, sites)}
+    for site in sorted(existing):
+        print(f"SKIPPED adding site '{site}' as it already exists")
+    missing = [site for site in sites if site not in existing]
+    if not missing:
+        return
+
     region_id = nb.dcim.regions.get(name=default_items['region']).id
     sitegroup_id = nb.dcim.site_groups.get(name=default_items['site-group']).id
     tenant_id = nb.tenancy.tenants.get(name=default_items['tenant']).id
 
-    for site in sites:
-        try:
-            result = nb.dcim.sites.create(
-                name=site,
-                slug=slugify(site),
-                status=status,
-                region=region_id,
-                group=sitegroup_id,
-                tenant=tenant_id,
-                time_zone=default_items['timezone']
-            )
-        except pynetbox.core.query.RequestError as e:
-            if "already exists" in e.error:
-                print(f"SKIPPED adding site '{site}' as it already exists")
-            else:
-                print(e.error)
-        else:
-            print(f"Site '{result}' created.")
+    results = bulk_create(nb.dcim.sites,
+                          [{'name': site,
+                            'slug': slugify(site),
+                            'status': status,
+                            'region': region_id,
+                            'group': sitegroup_id,
+                            'tenant': tenant_id,
+                            'time_zone': default_items['timezone']}
+                           for site in missing],
+                          'site')
+    for result in results:
+        print(f"Site '{result}' created.")
 
 
 def build_locations(nb, locations, default_items):
@@ -303,31 +531,48 @@ def build_locations(nb, locations, default_items):
     #   site (as id)
     #   I will also assume status, tenant
     #       change to suit your situation
+    # Existing sites and locations are found with one snapshot; only
+    # missing locations are created, with bulk requests
     status = "planned" # Provide as string to create method
 
-    tenant_id = nb.tenancy.tenants.get(name=default_items['tenant']).id
+    locations = [location for location in locations
+                 if pd.notna(location[0]) and pd.notna(location[1])]
+    site_ids = {site.name: site.id for site in
+                filter_by_names(nb.dcim.sites, {site for site, _ in locations})}
+    existing = set()
+    if site_ids:
+        existing = {(location.site.id, location.name) for location in
+                    filter_by_names(nb.dcim.locations,
+                                    {name for _, name in locations},
+                                    site_id=sorted(site_ids.values()))}
 
-    for location in locations:
-        try:
-            #print(location)
-            # modify name to fit url-friendly slug version
-            #slug = location[1].lower().replace(" ", "").replace(",", "_")
-            site_id = nb.dcim.sites.get(name=location[0]).id
-            result = nb.dcim.locations.create(
-                name=location[1],
-                slug=slugify(location[1]),
-                site=site_id,
-                status=status,
-                tenant=tenant_id
-            )
-        except pynetbox.core.query.RequestError as e:
-            if "already exists" in e.error:
-                print(f"SKIPPED adding location '{location[1]}' "
-                      f"as it already exists in site '{location[0]}'")
-            else:
-                print(e.error)
+    missing = []
+    for site, name in locations:
+        if site not in site_ids:
+            print(f"SKIPPED adding location '{name}' as site '{site}' "
+                  f"does not exist")
+        elif (site_ids[site], name) in existing:
+            print(f"SKIPPED adding location '{name}' "
+                  f"as it already exists in site '{site}'")
         else:
-            print(f"Location '{result}' created.")
+            missing.append((site, name))
+    if not missing:
+        return
+
+    tenant_id = nb.tenancy.tenants.get(name=default_items['tenant']).id
+
+    # modify name to fit url-friendly slug version
+    #slug = location[1].lower().replace(" ", "").replace(",", "_")
+    results = bulk_create(nb.dcim.locations,
+                          [{'name': name,
+                            'slug': slugify(name),
+                            'site': site_ids[site],
+                            'status': status,
+                            'tenant': tenant_id}
+                           for site, name in missing],
+                          'location')
+    for result in results:
+        print(f"Location '{result}' created.")
 
 
 def create_nb_devicetype(nb, devicetype):
@@ -395,9 +640,9 @@ def map_devicetypes(nb, inventory_dict):
     faster retreival in the future
     """
     # Get all unique device-type entries from inventory input
-    unique_dts = {device['DeviceType'] for device in inventory_dict}
-    #print(unique_dts)
-    unique_dts.remove(np.nan)
+    # (blank entries are NaN; a chunk may not have any)
+    unique_dts = {device['DeviceType'] for device in inventory_dict
+                  if pd.notna(device['DeviceType'])}
     #print(unique_dts)
     
     # send unique entries to map_dt2netbox() module, receiving latest
@@ -406,10 +651,250 @@ def map_devicetypes(nb, inventory_dict):
     return final_dt_map
 
 
-def build_devices(nb, devices, default_items, args, dt_mappings):
+class ReferenceResolver:
+    """Batch resolver for the NetBox objects an inventory refers to
+
+    Collects the distinct sites, (site, location) pairs, roles and
+    tenants referenced by a chunk of inventory rows and resolves the ones
+    not seen before with a few name-filtered list calls.  Rows are then
+    resolved with dictionary lookups instead of per-row API calls.
+    Missing device roles are created.
+    """
+    def __init__(self, nb):
+        self.nb = nb
+        self.roles = {}
+        self.tenants = {}
+        self.sites = {}
+        self.locations = {}
+
+    def resolve(self, rows, roles=(), tenants=()):
+        """Resolve everything 'rows' (and the given roles and tenants)
+        refer to that is not already known"""
+        nb = self.nb
+        missing_roles = set(roles) - self.roles.keys()
+        for role in filter_by_names(nb.dcim.device_roles, missing_roles):
+            self.roles[role.name] = role.id
+        for role in missing_roles - self.roles.keys():
+            self.roles[role] = create_nb_device_role(nb, role).id
+
+        missing_tenants = set(tenants) - self.tenants.keys()
+        for tenant in filter_by_names(nb.tenancy.tenants, missing_tenants):
+            self.tenants[tenant.name] = tenant.id
+
+        missing_sites = {row['Site'] for row in rows
+                         if pd.notna(row['Site'])} - self.sites.keys()
+        for site in filter_by_names(nb.dcim.sites, missing_sites):
+            self.sites[site.name] = site.id
+
+        missing_locations = {(row['Site'], row['Location']) for row in rows
+                             if row['Site'] in self.sites
+                             and pd.notna(row['Location'])} - self.locations.keys()
+        if missing_locations:
+            site_names = {site_id: name for name, site_id in self.sites.items()}
+            site_ids = sorted({self.sites[site] for site, _ in missing_locations})
+            for location in filter_by_names(nb.dcim.locations,
+                                         {name for _, name in missing_locations},
+                                         site_id=site_ids):
+                key = (site_names.get(location.site.id), location.name)
+                self.locations[key] = location.id
+
+
+# Write-ahead journal of the devices imported, for --resume
+JOURNALFILE = 'import_csv2nb_journal.jsonl'
+# Content hash and NetBox ids of every device imported so far
+STATEFILE = 'import_csv2nb_state.json'
+
+
+def load_state(statefile=STATEFILE):
+    # Read the import state: {device name: {hash, device, interface, ip}}
+    try:
+        with open(statefile, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, statefile=STATEFILE):
+    # Write the state atomically, so a crash never leaves half a file
+    tmpfile = f'{statefile}.tmp'
+    with open(tmpfile, 'w') as file:
+        json.dump(state, file)
+    os.replace(tmpfile, statefile)
+
+
+class ImportJournal:
+    """Write-ahead journal of the inventory rows imported into NetBox
+
+    Each step of a device import is appended as one JSON line and forced
+    to disk: {"name": ..., "pending": step} before its POST, then
+    {"name": ..., step: id} once it returns - "device", "interface", "ip"
+    and finally "done" with the row hash.  A step left pending by a
+    crash is looked up in NetBox on resume (see find_pending) instead of
+    being POSTed again.  'progress' is the journal replayed into
+    {device name: {step: id}}.  Completed devices are folded into the
+    state file by compact().
+    """
+    def __init__(self, journalfile=JOURNALFILE, resume=False):
+        """Open the journal, replaying what an earlier run left in it
+
+        :param journalfile: path of the JSON-lines journal file
+        :param resume: keep the half-done devices, to finish them;
+            otherwise only completed devices are kept
+        """
+        self.progress = {}
+        if os.path.isfile(journalfile):
+            with open(journalfile, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line cut short by the crash
+                        continue
+                    self.progress.setdefault(entry.pop('name'), {}).update(entry)
+        if not resume:
+            self.progress = {name: steps for name, steps
+                             in self.progress.items() if steps.get('done')}
+        elif self.progress:
+            print(f'Resuming import: {len(self.progress)} devices in journal '
+                  f'{journalfile}')
+        self.file = open(journalfile, 'a')
+
+    def record(self, name, **steps):
+        # Append completed step(s) of device 'name' and sync to disk
+        self.progress.setdefault(name, {}).update(steps)
+        self.file.write(json.dumps({'name': name, **steps}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def compact(self, state, statefile=STATEFILE):
+        """Fold the devices completed in this run into the state file
+
+        Completed devices replace their state entries ({hash, device,
+        interface, ip}) and the state is saved; the journal is rewritten
+        with only the devices still half-done, for a later --resume.
+        """
+        incomplete = {}
+        for name, steps in self.progress.items():
+            if steps.get('done'):
+                state[name] = {step: value for step, value in steps.items()
+                               if step not in ('done', 'pending')}
+            else:
+                incomplete[name] = steps
+        save_state(state, statefile)
+        self.file.close()
+        tmpfile = f'{self.file.name}.tmp'
+        with open(tmpfile, 'w') as file:
+            for name, steps in incomplete.items():
+                file.write(json.dumps({'name': name, **steps}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpfile, self.file.name)
+        self.progress = incomplete
+        self.file = open(self.file.name, 'a')
+
+    def close(self):
+        self.file.close()
+
+
+def find_pending(nb, done, step, **filters):
+    """Look up the object of a step an interrupted run left pending
+
+    The crash may have come after NetBox created the object but before
+    the journal recorded its id; creating it again would fail as a
+    duplicate on every later run.
+
+    :param nb: (class of pynetbox.core.api.Api) Netbox session
+    :param done: journal progress of the device
+    :param step: 'device', 'interface' or 'ip'
+    :param filters: filter identifying the object, eg. name and site_id
+    :returns: id of the object found, or None when the step was not
+        pending or NetBox does not hold exactly one match
+    """
+    if done.get('pending') != step:
+        return None
+    endpoint = {'device': nb.dcim.devices, 'interface': nb.dcim.interfaces,
+                'ip': nb.ipam.ip_addresses}[step]
+    found = list(endpoint.filter(**filters))
+    if len(found) != 1:
+        return None
+    print(f"Found {step} '{found[0]}' created by the interrupted import")
+    return found[0].id
+
+
+def get_role_name(args):
+    # Device role for the switches being imported
+    if args.idf: return 'IDF'
+    if args.access: return 'Access'
+
+
+def row_hash(device, role):
+    # Content hash of a normalized inventory row and the role it is
+    # imported with; equal hashes mean NetBox already has this row
+    content = {key: (None if pd.isna(value) else value)
+               for key, value in device.items()}
+    return hashlib.sha1(json.dumps([content, role], sort_keys=True,
+                                   default=str).encode()).hexdigest()
+
+
+def device_fields(device, default_items, args, dt_mappings, resolver):
+    # NetBox device fields for an inventory row; None (and reported) if
+    # its device-type, site or location is not known in NetBox
+    name = device["Name"]
+    devicetype = device["DeviceType"]
+    
+    nb_devicetype_id = dt_mappings.get(devicetype)
+    print(f'{devicetype} is id "{nb_devicetype_id}"')
+    if nb_devicetype_id is None:
+        print(f"SKIPPED Device \'{name}\' as device-type "
+              f"'{devicetype}' is not mapped")
+        return None
+
+    '''nb_devicetype = nb.dcim.device_types.get(model=devicetype)
+    if nb_devicetype:
+        nb_devicetype_id = nb_devicetype.id
+    else:
+        nb_devicetype_id = create_nb_devicetype(nb, devicetype).id
+    #print(nb_devicetype_id)
+    '''
+    
+    #role = device["Custom_Function"]
+    nb_device_role_id = resolver.roles[get_role_name(args)]
+    #print(nb_devicetype_id)
+
+    site_id = resolver.sites.get(device["Site"])
+    print(f'Site Id for {device["Site"]} is {site_id}')
+    
+    tenant_id = resolver.tenants[default_items['tenant']]
+    print(f'Tenant Id for {default_items["tenant"]} is {tenant_id}')
+    
+    location_id = resolver.locations.get((device["Site"], device["Location"]))
+    print(f'Location Id for {device["Location"]} is {location_id}')
+    if site_id is None or location_id is None:
+        print(f"SKIPPED Device \'{name}\' as its site "
+              f"or location is not in NetBox")
+        return None
+    
+    serialnumber = device["SerialNumber"]
+    print(f'Serial Number for {name} is [{serialnumber}]')
+    return {'name': name,
+            'device_type': nb_devicetype_id,
+            'role': nb_device_role_id,
+            'tenant': tenant_id,
+            'serial': serialnumber,
+            'site': site_id,
+            'location': location_id,
+            'custom_fields': {'AreaRoom': device["AreaRoom"]}}
+
+
+def build_devices(nb, devices, default_items, args, dt_mappings, resolver,
+                  journal):
     """ Builds devices in Netbox via pynetbox library
     nb = netbox session
     devices = list of dictionary records of device info
+    dt_mappings = dictionary of imported device-type to NetBox id
+    resolver = ReferenceResolver, already resolved for these devices
+    journal = ImportJournal; a device imported partly in an earlier run
+        continues from its last completed step
     
     https://NETBOX/api/schema/swagger-ui/#/dcim/dcim_devices_create
         shows we need to provide name, device_type (int), role (int),
@@ -426,129 +911,102 @@ def build_devices(nb, devices, default_items, args, dt_mappings):
     status = "inventory" # Provide as string to create method
 
     for device in devices:
-        if device["Name"] is np.nan:
-            continue
+        # Name, SerialNumber and AreaRoom were normalized on read
+        name = device["Name"]
+        done = journal.progress.get(name, {})
         print("=" * 60)
         print(f"Working device {device['Name']} with parameters of:\n{device}")
-        name = device["Name"].lower()
-        devicetype = device["DeviceType"]
-        
-        nb_devicetype_id = [device['nb_dt_id'] for device in dt_mappings
-                            if device['imported_model'] == devicetype][0]
-        print(f'{devicetype} is id "{nb_devicetype_id}"')
-
-        '''nb_devicetype = nb.dcim.device_types.get(model=devicetype)
-        if nb_devicetype:
-            nb_devicetype_id = nb_devicetype.id
-        else:
-            nb_devicetype_id = create_nb_devicetype(nb, devicetype).id
-        #print(nb_devicetype_id)
-        '''
-        
-        if args.idf: role = 'IDF'
-        if args.access: role = 'Access'
-        #role = device["Custom_Function"]
-        nb_device_role = nb.dcim.device_roles.get(name=role)
-        if nb_device_role:
-            nb_device_role_id = nb_device_role.id
-        else:
-            nb_device_role_id = create_nb_device_role(nb, role).id
-        #print(nb_devicetype_id)
-
-        site_id = nb.dcim.sites.get(name=device["Site"]).id
-        print(f'Site Id for {device["Site"]} is {site_id}')
-        
-        tenant_id = nb.tenancy.tenants.get(name=default_items['tenant']).id
-        print(f'Tenant Id for {default_items["tenant"]} is {tenant_id}')
-        
-        #print(f'Looking for location {device["Location"]} under site {device["Site"]} / {site_id}')
-        #location_id = nb.dcim.locations.get({'name': device["Location"], 'site': {'name': device["Site"]}}).id
-        #print({'name': device["Location"], 'site': {'name': device["Site"]}})
-        location_id = nb.dcim.locations.get(name=device["Location"], site_id=site_id).id
-        print(f'Location Id for {device["Location"]} is {location_id}')
+        fields = device_fields(device, default_items, args, dt_mappings,
+                               resolver)
+        if fields is None:
+            continue
         
         # Now to actually add the device
-        print(type(device["SerialNumber"]))
-        if device["SerialNumber"] != device["SerialNumber"]:
-            # We got a nan / NaN value
-            serialnumber = ''
-            print('Got here')
-        else:
-            serialnumber = device["SerialNumber"]
-        print(f'Serial Number for {name} is [{serialnumber}]')
-        
-        if device["AreaRoom"] != device["AreaRoom"]:
-            # We got a nan / NaN value
-            arearoom = 'TBD'
-        else:
-            arearoom = device["AreaRoom"]
-        
-        print(f'Setting device with values\n{name}, {nb_devicetype_id}, '
-              f'{nb_device_role_id}, {tenant_id}, {serialnumber}, '
-              f'{site_id}, {location_id}, {status}, {arearoom}')
-        try:
-            result = nb.dcim.devices.create(
-                name=name,
-                device_type=nb_devicetype_id,
-                role=nb_device_role_id,
-                tenant=tenant_id,
-                serial=serialnumber,
-                site=site_id,
-                location=location_id,
-                status=status,
-                custom_fields={'AreaRoom': arearoom}
-            )
-        except pynetbox.core.query.RequestError as e:
-            if "dcim_device_unique_name_site_tenant" in e.error:
-                print(f"SKIPPED adding Device \'{device['Name']}\' "
-                        f"as it already exists in site")
-                continue
+        device_id = done.get('device') or find_pending(
+            nb, done, 'device', name=fields['name'], site_id=fields['site'])
+        if device_id is not None and 'device' not in done:
+            journal.record(name, device=device_id)
+        if device_id is None:
+            journal.record(name, pending='device')
+            print(f'Setting device with values\n{fields}, {status}')
+            try:
+                result = nb.dcim.devices.create(status=status, **fields)
+            except pynetbox.core.query.RequestError as e:
+                if "dcim_device_unique_name_site_tenant" in e.error:
+                    print(f"SKIPPED adding Device \'{device['Name']}\' "
+                            f"as it already exists in site")
+                    continue
+                else:
+                    print(e.error)
+                    continue
             else:
-                print(e.error)
-        else:
-            print(f"Device '{result}' created.")
+                print(f"Device '{result}' created.")
+            device_id = result.id
+            journal.record(name, device=device_id)
         
         # Build the management interface
-        try:
-            result = nb.dcim.interfaces.create(
-                device=nb.dcim.devices.get(name=name).id,
-                vdcs=[],
-                name='Management',
-                type='virtual'
-            )
-        except pynetbox.core.query.RequestError as e:
-            if "already exists" in e.error:
-                print(f"SKIPPED adding Interface 'Management' to device "
-                      f"\'{name}\' as it already exists")
+        interface_id = done.get('interface') or find_pending(
+            nb, done, 'interface', device_id=device_id, name='Management')
+        if interface_id is not None and 'interface' not in done:
+            journal.record(name, interface=interface_id)
+        if interface_id is None:
+            journal.record(name, pending='interface')
+            try:
+                result = nb.dcim.interfaces.create(
+                    device=device_id,
+                    vdcs=[],
+                    name='Management',
+                    type='virtual'
+                )
+            except pynetbox.core.query.RequestError as e:
+                if "already exists" in e.error:
+                    print(f"SKIPPED adding Interface 'Management' to device "
+                          f"\'{name}\' as it already exists")
+                else:
+                    print(e.error)
+                continue
             else:
-                print(e.error)
-        else:
-            print(f"Interface '{result}' for '{name}' created.")
+                print(f"Interface '{result}' for '{name}' created.")
+            interface_id = result.id
+            journal.record(name, interface=interface_id)
         
         # Associate the IP Address to the new device's management int
         # If the device has no IP to associate to a management int; continue
-        if device['ManagementIP'] is np.nan: continue
-        try:
-            result = nb.ipam.ip_addresses.create(
-                address=device["ManagementIP"],
-                status='reserved',
-                assigned_object_id=result.id,
-                assigned_object_type="dcim.interface"
-            )
-        except pynetbox.core.query.RequestError as e:
-            if "already exists" in e.error:
-                print(f"SKIPPED adding IP \'{device['ManagementIP']} "
-                      f"as it already exists")
+        if pd.isna(device['ManagementIP']):
+            journal.record(name, done=True,
+                           hash=row_hash(device, get_role_name(args)))
+            continue
+        ip_id = done.get('ip') or find_pending(
+            nb, done, 'ip', address=device['ManagementIP'],
+            interface_id=interface_id)
+        if ip_id is not None and 'ip' not in done:
+            journal.record(name, ip=ip_id)
+        if ip_id is None:
+            journal.record(name, pending='ip')
+            try:
+                result = nb.ipam.ip_addresses.create(
+                    address=device["ManagementIP"],
+                    status='reserved',
+                    assigned_object_id=interface_id,
+                    assigned_object_type="dcim.interface"
+                )
+            except pynetbox.core.query.RequestError as e:
+                if "already exists" in e.error:
+                    print(f"SKIPPED adding IP \'{device['ManagementIP']} "
+                          f"as it already exists")
+                else:
+                    print(e.error)
+                continue
             else:
-                print(e.error)
-        else:
-            print(f"IP Address \'{device['ManagementIP']}\' created.")
+                print(f"IP Address \'{device['ManagementIP']}\' created.")
+            ip_id = result.id
+            journal.record(name, ip=ip_id)
         
         # Re-associate to device with a patch/update
         try:
             result = nb.dcim.devices.update([
-                {'id': nb.dcim.devices.get(name=name).id,
-                 'primary_ip4': result.id}
+                {'id': device_id,
+                 'primary_ip4': ip_id}
             ])
         except pynetbox.core.query.RequestError as e:
             if "already exists" in e.error:
@@ -558,9 +1016,97 @@ def build_devices(nb, devices, default_items, args, dt_mappings):
                 print(e.error)
         else:
             print(f"IP Address \'{device['ManagementIP']}\' associated.")
+            journal.record(name, done=True,
+                           hash=row_hash(device, get_role_name(args)))
 
 
 
+def update_devices(nb, devices, state, default_items, args, dt_mappings,
+                   resolver, journal):
+    """Update devices whose inventory row changed since the last import
+
+    The devices, their management interface and IP are known by id from
+    the state file, so only PATCHes (bulk, per endpoint) are sent:
+    device fields, the IP address, a new IP (created on the known
+    interface and made primary) or a removed one (deleted).  A device
+    whose IP or device request failed keeps its old row hash, so it is
+    updated again on the next run.
+
+    :param nb: (class of pynetbox.core.api.Api) Netbox session
+    :param devices: changed inventory rows, all present in 'state'
+    :param state: import state, {device name: {hash, device, interface, ip}}
+    :param journal: ImportJournal the updated devices are recorded in
+    """
+    role = get_role_name(args)
+    rows = {device['Name']: device for device in devices}
+    device_patches = {}
+    ip_patches = {}
+    new_ips = []
+    removed_ips = {}
+    for name, device in rows.items():
+        known = state[name]
+        print(f"Updating device {name} (id {known['device']})")
+        fields = device_fields(device, default_items, args, dt_mappings,
+                               resolver)
+        if fields is None:
+            continue
+        device_patches[name] = {'id': known['device'], **fields}
+        if pd.isna(device['ManagementIP']):
+            if known.get('ip'):
+                device_patches[name]['primary_ip4'] = None
+                removed_ips[name] = known['ip']
+        elif known.get('ip'):
+            ip_patches[known['ip']] = {'id': known['ip'],
+                                       'address': device['ManagementIP']}
+        else:
+            new_ips.append({'address': device['ManagementIP'],
+                            'status': 'reserved',
+                            'assigned_object_id': known['interface'],
+                            'assigned_object_type': 'dcim.interface'})
+
+    # Every step is tracked per device; a device is only recorded with its
+    # new row hash when all of its steps succeeded, so a failed step is
+    # retried on the next run.  New IPs go first, so the device patch can
+    # make them primary
+    interfaces = {state[name]['interface']: name for name in device_patches}
+    ip_ids = {}
+    for ip in bulk_create(nb.ipam.ip_addresses, new_ips, 'IP Address'):
+        name = interfaces[ip.assigned_object_id]
+        ip_ids[name] = ip.id
+        device_patches[name]['primary_ip4'] = ip.id
+    failed = {interfaces[ip['assigned_object_id']]
+              for ip in new_ips} - set(ip_ids)
+    ip_names = {state[name].get('ip'): name for name in device_patches}
+    patched = {ip_names[ip.id] for ip in bulk_update(
+        nb.ipam.ip_addresses, list(ip_patches.values()), 'IP Address')}
+    failed |= {ip_names[ip_id] for ip_id in ip_patches} - patched
+    device_names = {patch['id']: name for name, patch in device_patches.items()}
+    updated = {device_names[record.id] for record in bulk_update(
+        nb.dcim.devices, list(device_patches.values()), 'Device')}
+    failed |= set(device_patches) - updated
+    # An IP is only deleted once its device no longer has it as primary
+    deleted = [name for name in removed_ips if name in updated]
+    if deleted:
+        try:
+            nb.ipam.ip_addresses.delete([removed_ips[name] for name in deleted])
+        except pynetbox.core.query.RequestError as e:
+            print(f"FAILED deleting IP Addresses of {deleted}: {e.error}")
+            failed.update(deleted)
+            deleted = []
+    for name in device_patches:
+        steps = {**state[name], 'done': True}
+        if name in ip_ids:
+            steps['ip'] = ip_ids[name]
+        elif name in deleted:
+            steps.pop('ip', None)
+        if name in failed:
+            print(f"Device '{name}' only partly updated; retried next run")
+        else:
+            steps['hash'] = row_hash(rows[name], role)
+            print(f"Device '{name}' updated.")
+        journal.record(name, **steps)
+
+
 def importinfra(nb, args):
     """Import infrastructure records from project YAML file
      
@@ -573,29 +1119,66 @@ def importinfra(nb, args):
     :param args: (argparse namespace dictionary) import file, idf or 
         access switch settings
     """
-    default_items = getparam('defaults', envfile='infra.yaml')
+    infra = load_infra()
+    default_items = infra.get('defaults')
 
-    # Process Tenant-Groups
-    '''process_tg(nb)
-    process_tenants(nb)
-    process_regions(nb)
-    process_sitegroups(nb)
-    '''
-    #process_sites(nb)
-    #process_manufacturers(nb)
+    # Process Tenant-Groups, Tenants, Regions, Site-Groups, Sites and
+    # Manufacturers
+    if args.infra:
+        process_infra(nb, infra)
     
-    inventory_dict = opencsv(args.file)
-    #print(inventory_dict)
-
-    # Import Sites (process sub-sites)
-    sites = get_sites(inventory_dict)
-    #print(sites)
-    build_sites(nb, sites, default_items)
-    locations = get_locations(inventory_dict)
-    build_locations(nb, locations, default_items)
-    dt_mappings = map_devicetypes(nb, inventory_dict)
-    #print(dt_mappings)
-    build_devices(nb, inventory_dict, default_items, args, dt_mappings)
+    # Work through the inventory one chunk at a time; sites and
+    # locations are only built the first time a chunk references them
+    known_sites = set()
+    known_locations = set()
+    resolver = ReferenceResolver(nb)
+    role = get_role_name(args)
+    state = load_state()
+    journal = ImportJournal(resume=args.resume)
+    # Devices an earlier (interrupted) run completed go into the state
+    journal.compact(state)
+    for inventory_dict in open_inventory(args.file, chunksize=args.chunksize,
+                                     jobs=args.jobs):
+        # Rows unchanged since they were imported cost no API call; rows
+        # imported before but changed are updated by id
+        new_rows = []
+        changed_rows = []
+        for row in inventory_dict:
+            known = state.get(row['Name'])
+            if known is None:
+                new_rows.append(row)
+            elif args.full or known['hash'] != row_hash(row, role):
+                changed_rows.append(row)
+        print(f'{len(inventory_dict) - len(new_rows) - len(changed_rows)} '
+              f'unchanged, {len(changed_rows)} changed and {len(new_rows)} '
+              f'new devices in chunk')
+        inventory_dict = new_rows + changed_rows
+        if not inventory_dict:
+            continue
+        # Import Sites (process sub-sites)
+        sites = [site for site in get_sites(inventory_dict)
+                 if site not in known_sites]
+        #print(sites)
+        if sites:
+            build_sites(nb, sites, default_items)
+            known_sites.update(sites)
+        locations = [location for location in get_locations(inventory_dict)
+                     if location not in known_locations]
+        if locations:
+            build_locations(nb, locations, default_items)
+            known_locations.update(locations)
+        dt_mappings = map_devicetypes(nb, inventory_dict)
+        #print(dt_mappings)
+        resolver.resolve(inventory_dict, roles=[role],
+                         tenants=[default_items['tenant']])
+        if changed_rows:
+            update_devices(nb, changed_rows, state, default_items, args,
+                           dt_mappings, resolver, journal)
+        if new_rows:
+            build_devices(nb, new_rows, default_items, args, dt_mappings,
+                          resolver, journal)
+    journal.compact(state)
+    journal.close()
 
 
 def main(file):
@@ -627,7 +1210,23 @@ def get_cli_args():
                                      ' from Excel (as CSV) to NetBox',
                                     )
     parser.add_argument('-f', '--file', default='SwitchInv.csv',
-                        help='CSV file to use for import, must be in current directory')
+                        help='CSV/XLSX file, directory or glob of files '
+                        'to use for import')
+    parser.add_argument('-c', '--chunksize', type=int, default=5000,
+                        help='Rows read and imported per chunk')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Processes parsing XLSX workbooks in parallel '
+                        '(default: CPU count)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Finish the devices an interrupted import '
+                        'left half-done, from the import journal')
+    parser.add_argument('--full', action='store_true',
+                        help='Update every device imported before, even '
+                        'if its row is unchanged')
+    parser.add_argument('--infra', action='store_true',
+                        help='First create missing tenant-groups, tenants, '
+                        'regions, site-groups, sites and manufacturers '
+                        'from infra.yaml')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-i', '--idf', action='store_true',
                        help='IDF switches are being imported')
@@ -11,6 +11,8 @@ Outputs:
 
 Version log
 v1    2024-0425  Initial development
+v2    2026-1017  Use cached device-type catalog
+                 Keep mappings in the shared SQLite mapping store
 #                                                                      #
 
 Copyright 2024 Cisco Systems
@@ -31,7 +33,7 @@ Credits:
 TBD
 """
 
-__version__ = '1'
+__version__ = '2'
 __author__ = 'Jason Davis - jadavis@cisco.com'
 __license__ = 'Apache License, Version 2.0 - ' \
     'http://www.apache.org/licenses/LICENSE-2.0'
@@ -57,6 +59,9 @@ from pprint import pprint
 from fuzzywuzzy import fuzz
 import re
 
+from common.dtCatalog import get_devicetypes
+from common.dtMapStore import DTMapStore
+
 # Global variables for script - do not change
 # GLOBALVAR = Null
 
@@ -101,7 +106,7 @@ def TEMPLATE_function(sender, recipient, message_body, priority=1) -> int:
 
 ####
 
-def create_dt_mappings(nb_devicetypes, imported_devicetypes, nb):
+def create_dt_mappings(nb_devicetypes, imported_devicetypes, nb, store):
     """Create Device Type Mappings
     
     The Device Type names from the NetBox Community Device Type project
@@ -114,6 +119,7 @@ def create_dt_mappings(nb_devicetypes, imported_devicetypes, nb):
         names
     :param list ap_models: The AP model types extracted from the WLC
     :param NBSessionHandler nb: NetBox session handler
+    :param DTMapStore store: device-type mapping store to update
 
     :return: mapping of WLC types to NB name and id
     :rtype: list of dictionaries
@@ -175,9 +181,10 @@ def create_dt_mappings(nb_devicetypes, imported_devicetypes, nb):
         print("-" * 40)
 
     if fileupdates:
-        with open('dt2nb_mapping.json', 'a') as file:
-            json.dump(fileupdates, file)
+        store.add('csv', [(update['imported_model'], update['nb_model'],
+                           update['nb_dt_id']) for update in fileupdates])
     #print(tuples_list)
+    return fileupdates
 
 
 def map2nbdt(nb, dt_model_list):
@@ -198,33 +205,20 @@ def map2nbdt(nb, dt_model_list):
     :param nb: NetBox session handler
     :type nb: class 'pynetbox.core.api.Api'
     :param str dt_model_list: List of imported device models for comparison
-
+    :returns: mapping of imported model to NetBox device-type id
+    :rtype: dict
     """
-    print(type(nb))
-    original_content = None
-    try:
-        with open('dt2nb_mapping.json', 'r') as file:
-            known_mappings = json.load(file)
-    except FileNotFoundError:
-        # No previous mapping file, so safe to assume we've never done
-        # this process
-        print('No existing "dt2nb_mapping.json" file - will create one.')
-    else:
-        print(known_mappings)
-        missing_dts = [device_type for device_type in dt_model_list
-                       if not any(model['imported_model'] == device_type 
-                       for model in known_mappings)]
-        print(f'Missing the following device-types: {missing_dts}')
-        if not missing_dts:
-            return known_mappings
-
-    nb_devicetype_partnums = [dt.part_number for dt in list(nb.dcim.device_types.all())]
-    #print(nb_devicetype_partnums)
-    #print(ap_models)
-    create_dt_mappings(nb_devicetype_partnums, dt_model_list, nb)
-    with open('dt2nb_mapping.json', 'r') as file:
-        known_mappings = json.load(file)
-    return known_mappings
+    store = DTMapStore()
+    # Carry over mappings from the legacy JSON file, if there is one
+    store.import_legacy_json('csv', 'dt2nb_mapping.json', 'imported_model')
+
+    missing_dts = store.missing('csv', dt_model_list)
+    print(f'Missing the following device-types: {missing_dts}')
+    if missing_dts:
+        nb_devicetype_partnums = [dt['part_number'] for dt in get_devicetypes(nb)]
+        #print(nb_devicetype_partnums)
+        create_dt_mappings(nb_devicetype_partnums, missing_dts, nb, store)
+    return store.mappings('csv')
 
 
 ####### Module Function definitions above